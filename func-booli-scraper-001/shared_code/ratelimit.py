@@ -0,0 +1,172 @@
+"""Client-side rate limiting and retries, shared by every outgoing HTTP request of the function app."""
+import logging
+import random
+import threading
+import time
+import requests
+
+from datetime import datetime
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+# Errors worth retrying that never got a response
+NETWORK_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+# Client-side limits per host, hosts not listed get the HostRateLimiter defaults
+RATE_LIMITS = {
+    "www.booli.se": {"rate": 5, "burst": 5, "max_concurrency": 8}
+}
+
+class HostRateLimiter:
+    """Token bucket plus an adaptive (AIMD) concurrency limit, shared process-wide per host."""
+    limiters = {}
+    limiters_lock = threading.Lock()
+
+    def __init__(self, rate = 5, burst = 5, max_concurrency = 8):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.blocked_until = 0
+        self.condition = threading.Condition()
+
+    @classmethod
+    def get(cls, host):
+        with cls.limiters_lock:
+            if host not in cls.limiters:
+                cls.limiters[host] = cls(**RATE_LIMITS.get(host, {}))
+            return cls.limiters[host]
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.blocked_until > now:
+                    timeout = self.blocked_until - now
+                elif self.tokens < 1:
+                    timeout = (1 - self.tokens) / self.rate
+                elif self.in_flight >= self.concurrency:
+                    timeout = None
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout)
+
+    def release(self, throttled = False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                # Multiplicative decrease on errors, additive increase after a full window of successes
+                self.concurrency = max(1, self.concurrency // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        """Block every request to the host for the given number of seconds."""
+        with self.condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RetryPolicy:
+    """Retries network errors and 429/5xx responses with exponential backoff, anything else is raised right away."""
+    def __init__(self, max_retries = 5, backoff_factor = 1, max_backoff = 60, max_retry_after = 300, retry_status_codes = (429, 500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.retry_status_codes = retry_status_codes
+
+    def get_backoff(self, attempt):
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def get_retry_after(self, response):
+        """Seconds to wait according to the Retry-After header, None if it's missing or can't be parsed."""
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is None:
+            return None
+        try:
+            return max(0, float(retry_after))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return max(0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+            except (TypeError, ValueError):
+                return None
+
+    def is_retryable(self, exception):
+        if isinstance(exception, NETWORK_ERRORS):
+            return True
+        status_code = getattr(getattr(exception, "response", None), "status_code", None)
+        return status_code in self.retry_status_codes
+
+    def call(self, host, function, *args, **kwargs):
+        """Call function under the host's rate limit, retrying network errors and 429/5xx HTTP errors."""
+        limiter = HostRateLimiter.get(host)
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire()
+            throttled = False
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                throttled = self.is_retryable(e)
+                if not throttled or attempt == self.max_retries:
+                    raise
+                delay = self.get_backoff(attempt)
+                logging.warning(f"Request to {host} failed ({e}), retrying in {delay:.1f}s")
+            finally:
+                limiter.release(throttled)
+            limiter.pause(delay)
+
+
+class ThrottledSession(requests.Session):
+    """requests.Session that rate limits per host and retries 429/5xx and connection errors."""
+    def __init__(self, retry_policy = None, pool_maxsize = 10):
+        super().__init__()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.mount("https://", HTTPAdapter(pool_maxsize = pool_maxsize))
+        self.mount("http://", HTTPAdapter(pool_maxsize = pool_maxsize))
+
+    def request(self, method, url, *args, **kwargs):
+        policy = self.retry_policy
+        host = urlparse(url).netloc
+        limiter = HostRateLimiter.get(host)
+        for attempt in range(policy.max_retries + 1):
+            limiter.acquire()
+            throttled = False
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except NETWORK_ERRORS as e:
+                throttled = True
+                if attempt == policy.max_retries:
+                    raise
+                delay = policy.get_backoff(attempt)
+                logging.warning(f"Request to {host} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                throttled = response.status_code in policy.retry_status_codes
+                if not throttled or attempt == policy.max_retries:
+                    return response
+                delay = policy.get_retry_after(response)
+                if delay is None:
+                    delay = policy.get_backoff(attempt)
+                elif delay > policy.max_retry_after:
+                    logging.warning(f"Request to {host} returned {response.status_code} with Retry-After {delay:.0f}s, more than max_retry_after {policy.max_retry_after}s, not retrying")
+                    return response
+                logging.warning(f"Request to {host} returned {response.status_code}, retrying in {delay:.1f}s")
+                response.close()
+            finally:
+                limiter.release(throttled)
+            limiter.pause(delay)
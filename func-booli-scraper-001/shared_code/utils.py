@@ -1,13 +1,21 @@
 import queue
+import json
+import os
+import re
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import logging
 import requests
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from lxml import html
 from io import BytesIO
 from io import StringIO
-from datetime import date
+from datetime import date, datetime, timedelta
+from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
 from azure.storage.filedatalake import DataLakeServiceClient
 from azure.identity import DefaultAzureCredential
@@ -17,38 +25,101 @@ from azure.storage.queue import (
         BinaryBase64EncodePolicy,
         BinaryBase64DecodePolicy
 )
+from shared_code.ratelimit import RATE_LIMITS, HostRateLimiter, RetryPolicy, ThrottledSession
+class ByteBudget:
+    """Bounds the number of bytes that are downloaded and decoded at the same time."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        # A blob larger than the whole budget is let through on its own
+        size = min(size, self.max_bytes)
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight == 0 or self.in_flight + size <= self.max_bytes)
+            self.in_flight += size
+        return size
+
+    def release(self, size):
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+class ClientRegistry:
+    """Process-wide cache of credentials, Key Vault secrets and service clients, kept across warm invocations."""
+    lock = threading.RLock()
+    clients = {}
+    secrets = {}
+    secret_ttl = int(os.getenv("KEY_VAULT_SECRET_TTL", 3600))
+
+    @classmethod
+    def get_or_create(cls, key, factory):
+        with cls.lock:
+            if key not in cls.clients:
+                cls.clients[key] = factory()
+            return cls.clients[key]
+
+    @classmethod
+    def get_credential(cls):
+        return cls.get_or_create("credential", lambda: DefaultAzureCredential(additionally_allowed_tenants=['*']))
+
+    @classmethod
+    def get_secret(cls, secret_client, secret_name):
+        key = (secret_client.vault_url, secret_name)
+        with cls.lock:
+            cached = cls.secrets.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        
+        secret = secret_client.get_secret(secret_name)
+        with cls.lock:
+            cls.secrets[key] = (time.monotonic() + cls.secret_ttl, secret)
+        return secret
+
+
 class AzureUtils:
-    def __init__(self, vault_url=None, storageaccount=None):
+    def __init__(self, vault_url=None, storageaccount=None, max_workers = None, max_in_flight_bytes = None):
         self.vault_url = "https://kv-booli-prod-001.vault.azure.net/"
+        # Clients are per instance so concurrent invocations in one worker don't overwrite each other's,
+        # the underlying SDK clients come from ClientRegistry and are safe to share between threads
+        self.blob_service_client = None
+        self.datalake_service_client = None
+        self.queue_client = None
+        self.max_workers = max_workers or int(os.getenv("BLOB_DOWNLOAD_WORKERS", 16))
+        self.max_in_flight_bytes = max_in_flight_bytes or int(os.getenv("BLOB_DOWNLOAD_MAX_BYTES", 256 * 1024 * 1024))
 
     def initialize_storage_account_ad(self, storage_account_secret, blob):
         try:  
-            global blob_service_client_instance
-            blob_service_client_instance = BlobServiceClient(
-                account_url = "{}://{}.blob.core.windows.net".format("https", blob), 
-                credential = storage_account_secret
+            account_url = "{}://{}.blob.core.windows.net".format("https", blob)
+            self.blob_service_client = ClientRegistry.get_or_create(
+                ("blob", account_url, storage_account_secret),
+                lambda: BlobServiceClient(account_url = account_url, credential = storage_account_secret)
                 )
         except Exception as e:
             logging.error(f"Could not create blob service client: {e}")
             
     def initialize_data_lake(self, storage_account_name, storage_account_secret):
         try:  
-            global datalake_service_client
-            datalake_service_client = DataLakeServiceClient(
-                account_url = "{}://{}.dfs.core.windows.net".format("https", storage_account_name), 
-                credential = storage_account_secret
+            account_url = "{}://{}.dfs.core.windows.net".format("https", storage_account_name)
+            self.datalake_service_client = ClientRegistry.get_or_create(
+                ("datalake", account_url, storage_account_secret),
+                lambda: DataLakeServiceClient(account_url = account_url, credential = storage_account_secret)
                 )
         except Exception as e:
             logging.error(f"Could not create data lake service client: {e}")
 
     def initialize_queue_client(self, accountUrl, queueName):
         try:  
-            global queue_client_instance
-            queue_client_instance = QueueClient.from_connection_string(
-                conn_str = accountUrl, 
-                queue_name = queueName,
-                message_encode_policy = BinaryBase64EncodePolicy(),
-                message_decode_policy = BinaryBase64DecodePolicy()
+            self.queue_client = ClientRegistry.get_or_create(
+                ("queue", accountUrl, queueName),
+                lambda: QueueClient.from_connection_string(
+                    conn_str = accountUrl, 
+                    queue_name = queueName,
+                    message_encode_policy = BinaryBase64EncodePolicy(),
+                    message_decode_policy = BinaryBase64DecodePolicy()
+                    )
                 )
             logging.info(f"Connected to queue {queueName} successfully")
         except Exception as e:
@@ -56,21 +127,57 @@ class AzureUtils:
 
     def send_queue_message(self, message):
         try:
-            queue_client_instance.send_message(message.encode("utf-8"))
+            self.queue_client.send_message(message.encode("utf-8"))
             logging.info(f"Queued message {message} successfully")
         except Exception as e:
             logging.error(f"Error queueing message {message}: {e}")
    
+    def upload_blob(self, data, container, blob_name):
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        try:
+            blob_client_instance.upload_blob(data, overwrite = True)
+            logging.info(f"Created blob {blob_name} successfully")
+            return True
+        except Exception as e:
+            logging.error(f"Error creating blob {blob_name}: {e}")
+            return False
+
+    def delete_blob(self, container, blob_name):
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        try:
+            blob_client_instance.delete_blob()
+            logging.info(f"Deleted blob {blob_name} successfully")
+            return True
+        except Exception as e:
+            logging.error(f"Error deleting blob {blob_name}: {e}")
+            return False
+
+    def upload_json_blob(self, data, container, blob_name):
+        return self.upload_blob(json.dumps(data), container, blob_name)
+
+    def download_json_blob(self, container, blob_name):
+        """Download and parse a json blob, returns None if the blob doesn't exist."""
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        try:
+            data = json.loads(blob_client_instance.download_blob().readall())
+            logging.info(f"Downloaded blob {blob_name} successfully")
+        except ResourceNotFoundError:
+            logging.info(f"Blob {blob_name} does not exist in container {container}")
+            data = None
+        return data
+
     def upload_csv_to_datalake(self, df, container, filename):
-        blob_client_instance = blob_service_client_instance.get_blob_client(container, filename)
+        blob_client_instance = self.blob_service_client.get_blob_client(container, filename)
         try:
             blob_client_instance.upload_blob(df.to_csv(index = False, encoding = "utf-8"), overwrite = True)
             logging.info(f"Successfully uploaded csv file {filename} to container {container}")
+            return True
         except Exception as e:
             logging.error(f"Error uploading csv file {filename} to container {container}: {e}")
+            return False
             
     def write_dataframe_to_datalake(self, df, dir_name, filename):
-        file_system_client = datalake_service_client.get_file_system_client(file_system = "gold")
+        file_system_client = self.datalake_service_client.get_file_system_client(file_system = "gold")
         directory_client = file_system_client.get_directory_client(dir_name)
         file_client = directory_client.create_file(f'{filename}_{date.today()}.Parquet')
         
@@ -80,7 +187,7 @@ class AzureUtils:
         return True
     
     def download_parquet_blob(self, container, blob_name):
-        blob_client_instance = blob_service_client_instance.get_blob_client(container, blob_name, snapshot = None)
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
         try:
             with BytesIO() as input_blob:
                 blob_client_instance.download_blob().download_to_stream(input_blob)
@@ -92,7 +199,7 @@ class AzureUtils:
         return df
     
     def download_csv_blob(self, container, blob_name):
-        blob_client_instance = blob_service_client_instance.get_blob_client(container, blob_name, snapshot = None)
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
         try:
             with BytesIO() as input_blob:
                 blob_client_instance.download_blob().download_to_stream(input_blob)
@@ -103,14 +210,98 @@ class AzureUtils:
             logging.error(f"Error downloadning blob {blob_name}: {e}")
         return df
     
+    def download_raw_blob(self, container, blob_name):
+        if blob_name.endswith(".parquet"):
+            return self.download_parquet_blob(container, blob_name)
+        return self.download_csv_blob(container, blob_name)
+
     def ingest_raw_data(self, blob_name_starts_with):
         blob_list = self.list_blobs(f"raw", blob_name_starts_with)
-        df = pd.concat([self.download_csv_blob(f"raw", blob.name) for blob in blob_list], ignore_index = True)
+        return self.ingest_raw_blobs(blob_list)
+
+    def download_blobs(self, container, blob_list, download_function):
+        """Download and decode blobs on a thread pool, keeping at most max_in_flight_bytes in flight. Results keep the order of blob_list."""
+        budget = ByteBudget(self.max_in_flight_bytes)
+
+        def download(blob):
+            size = budget.acquire(blob.size or 0)
+            try:
+                return download_function(container, blob.name)
+            finally:
+                budget.release(size)
+
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            return list(executor.map(download, blob_list))
+
+    def ingest_raw_blobs(self, blob_list):
+        df = pd.concat(self.download_blobs(f"raw", blob_list, self.download_raw_blob), ignore_index = True)
         return df
+
+    def blob_exists(self, container, blob_name):
+        return self.blob_service_client.get_blob_client(container, blob_name, snapshot = None).exists()
+
+    def download_parquet_table(self, container, blob_name, columns = None):
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        return pq.read_table(BytesIO(blob_client_instance.download_blob().readall()), columns = columns)
+
+    def fold_snapshots(self, container, directory, name):
+        """Turn full snapshots {directory}/{name}_{date}.parquet written before the dataset was split into parts into
+        its first part {directory}/{name}_0.parquet. The latest snapshot holds every row, the older ones are deleted."""
+        snapshots = sorted(blob.name for blob in self.list_blobs(container, f"{directory}/{name}_")
+                           if re.fullmatch(rf"{re.escape(directory)}/{re.escape(name)}_\d{{4}}-\d{{2}}-\d{{2}}\.parquet", blob.name))
+        if not snapshots:
+            return
+        first_part = f"{directory}/{name}_0.parquet"
+        logging.info(f"Folding snapshot {snapshots[-1]} into {first_part} and deleting {len(snapshots)} snapshots")
+        blob_client_instance = self.blob_service_client.get_blob_client(container, snapshots[-1], snapshot = None)
+        if not self.upload_blob(blob_client_instance.download_blob().readall(), container, first_part):
+            raise IOError(f"Could not fold {container}/{snapshots[-1]} into {first_part}")
+        # The latest snapshot goes last, if a delete fails the next run folds the same snapshot again
+        for snapshot in snapshots:
+            if not self.delete_blob(container, snapshot):
+                raise IOError(f"Could not delete snapshot {container}/{snapshot}")
+
+    def append_new_rows(self, df, container, directory, name, keys):
+        """Store the rows of df whose keys aren't in the dataset yet as a new part, returns the number of rows appended.
+
+        A dataset is every parquet blob in container/directory whose name starts with name, earlier parts are never
+        rewritten. The keys of all parts are kept in a sidecar {directory}/_keys/{name}.parquet together with the names
+        of the parts it covers, so only parts it doesn't cover yet have their key columns read.
+        """
+        self.fold_snapshots(container, directory, name)
+        sidecar_name = f"{directory}/_keys/{name}.parquet"
+        parts = [blob.name for blob in self.list_blobs(container, f"{directory}/{name}") if blob.name.endswith(".parquet")]
+        covered = []
+        key_frames = []
+        if self.blob_exists(container, sidecar_name):
+            sidecar = self.download_parquet_table(container, sidecar_name)
+            covered = json.loads(sidecar.schema.metadata[b"parts"])
+            key_frames.append(sidecar.replace_schema_metadata(None).to_pandas())
+        key_frames += [self.download_parquet_table(container, part, keys).to_pandas() for part in parts if part not in covered]
+
+        # Keys are compared with the dtypes of the new rows, so older parts written with e.g. float ids still match
+        df = df.drop_duplicates(subset = keys, keep = "last")
+        existing_keys = pd.concat(key_frames, ignore_index = True).astype(df[keys].dtypes.to_dict()) if key_frames else df[keys].iloc[:0]
+        df = df[~df.set_index(keys).index.isin(existing_keys.set_index(keys).index)]
+        if df.empty:
+            logging.info(f"No new rows for {container}/{directory}/{name}")
+            return 0
+
+        part_name = f"{directory}/{name}_{time.time_ns()}.parquet"
+        if not self.upload_blob(df.to_parquet(index = False), container, part_name):
+            raise IOError(f"Could not append {len(df)} rows to {container}/{directory}/{name}")
+
+        # A failed sidecar write only means the key columns of the new part are read on the next run
+        keys_table = pa.Table.from_pandas(pd.concat([existing_keys, df[keys]], ignore_index = True).sort_values(keys), preserve_index = False)
+        keys_table = keys_table.replace_schema_metadata({"parts": json.dumps(sorted(set(parts) | {part_name}))})
+        sink = pa.BufferOutputStream()
+        pq.write_table(keys_table, sink, compression = "zstd")
+        self.upload_blob(sink.getvalue().to_pybytes(), container, sidecar_name)
+        return len(df)
     
     def list_blobs(self, container, blob_name_starts_with):
         try:
-            container_client_instance = blob_service_client_instance.get_container_client(container)
+            container_client_instance = self.blob_service_client.get_container_client(container)
             blob_list = container_client_instance.list_blobs(blob_name_starts_with)
             logging.info(f"Retreived list of blobs that starts with name {blob_name_starts_with} from container {container}")
         except Exception as e:
@@ -118,53 +309,78 @@ class AzureUtils:
         return blob_list
             
     def initialize_key_vault(self):
-        credential = DefaultAzureCredential(additionally_allowed_tenants=['*'])
-        secret_client = SecretClient(vault_url = self.vault_url, credential=credential)
-        return secret_client
+        return ClientRegistry.get_or_create(
+            ("secret_client", self.vault_url),
+            lambda: SecretClient(vault_url = self.vault_url, credential = ClientRegistry.get_credential())
+            )
 
     def get_key_vault_secret(self, secret_client, secret_name):
-        return secret_client.get_secret(secret_name)
+        return ClientRegistry.get_secret(secret_client, secret_name)
+
 
 class Booli:
-    def __init__(self):
+    def __init__(self, max_workers = 8):
         self.path = "https://www.booli.se/graphql"
-        
-    def run_query_upcoming(self, object_type, rooms, area_id, page):
-        payload = """{
-            "operationName":"searchForSale",
-            "variables":{
-                "input":{
-                    "filters":[
-                        {
-                            "key":"objectType",
-                            "value":"%s"
-                        },
-                        {
-                            "key":"rooms",
-                            "value":"%s"
-                        },
-                        {
-                            "key":"isNewConstruction",
-                            "value":""
-                        },
-                        {
-                            "key":"priceDecrease",
-                            "value":""
-                        },
-                        {
-                            "key":"upcomingSale",
-                            "value":""
-                        }
-                    ],
-                    "areaId":"%s",
-                    "sort":"published",
-                    "page":%s,
-                    "ascending":false
-                }
-            },
-            "query":"query searchForSale($input: SearchRequest) { search: searchForSale(input: $input) { pages totalCount result { __typename ... on Listing { booliId descriptiveAreaName constructionYear floor{raw} livingArea{raw} listPrice{raw} rent{raw} listSqmPrice{raw} latitude longitude daysActive objectType rent{raw} operatingCost{raw} estimate{ price{raw} } rooms{raw} streetAddress url isNewConstruction biddingOpen upcomingSale mortgageDeed tenureForm plotArea{raw} hasPatio hasBalcony hasFireplace}} __typename  }}"
-        }"""
-        headers = {
+        self.max_workers = max_workers
+        # One pooled, rate limited session shared by all page requests so every page reuses the same TCP/TLS connections
+        self.session = ThrottledSession(pool_maxsize = max_workers)
+        # Flattened result fields and their types, named like pd.json_normalize names them
+        self.sold_fields = {
+            "booliId": pa.int64(),
+            "soldPrice.raw": pa.float64(),
+            "rent.raw": pa.float64(),
+            "streetAddress": pa.string(),
+            "constructionYear": pa.float64(),
+            "floor.raw": pa.float64(),
+            "soldSqmPrice.raw": pa.float64(),
+            "soldPriceAbsoluteDiff.raw": pa.float64(),
+            "soldPricePercentageDiff.raw": pa.float64(),
+            "listPrice.raw": pa.float64(),
+            "livingArea.raw": pa.float64(),
+            "rooms.raw": pa.float64(),
+            "objectType": pa.string(),
+            "descriptiveAreaName": pa.string(),
+            "soldPriceType": pa.string(),
+            "daysActive": pa.float64(),
+            "soldDate": pa.string(),
+            "latitude": pa.float64(),
+            "longitude": pa.float64(),
+            "url": pa.string(),
+            "__typename": pa.string()
+        }
+        self.upcoming_fields = {
+            "booliId": pa.int64(),
+            "descriptiveAreaName": pa.string(),
+            "constructionYear": pa.float64(),
+            "floor.raw": pa.float64(),
+            "livingArea.raw": pa.float64(),
+            "listPrice.raw": pa.float64(),
+            "rent.raw": pa.float64(),
+            "listSqmPrice.raw": pa.float64(),
+            "latitude": pa.float64(),
+            "longitude": pa.float64(),
+            "daysActive": pa.float64(),
+            "objectType": pa.string(),
+            "operatingCost.raw": pa.float64(),
+            "estimate.price.raw": pa.float64(),
+            "rooms.raw": pa.float64(),
+            "streetAddress": pa.string(),
+            "url": pa.string(),
+            "isNewConstruction": pa.bool_(),
+            "biddingOpen": pa.bool_(),
+            "upcomingSale": pa.bool_(),
+            "mortgageDeed": pa.float64(),
+            "tenureForm": pa.string(),
+            "plotArea.raw": pa.float64(),
+            "hasPatio": pa.bool_(),
+            "hasBalcony": pa.bool_(),
+            "hasFireplace": pa.bool_(),
+            "__typename": pa.string()
+        }
+        # Fields the pipelines actually keep, silver_sold drops the price diffs and __typename
+        self.sold_selected_fields = [field for field in self.sold_fields if field not in ("soldPriceAbsoluteDiff.raw", "soldPricePercentageDiff.raw", "__typename")]
+        self.upcoming_selected_fields = [field for field in self.upcoming_fields if field != "__typename"]
+        self.headers = {
             'authority': "www.booli.se",
             'accept': "*/*",
             'accept-language': "sv,en;q=0.9,en-GB;q=0.8,en-US;q=0.7",
@@ -176,79 +392,279 @@ class Booli:
             'sec-fetch-dest': "empty",
             'sec-fetch-mode': "cors",
             'sec-fetch-site': "same-origin",
-            'user-agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.5060.134 Safari/537.36 Edg/103.0.1264.71"
+            'user-agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.5060.134 Safari/537.36 Edg/103.0.1264.77"
         }
-        response = requests.post(self.path, data = payload % (object_type, rooms, area_id, page), headers=headers) # Throws 400
+
+    def iter_pages(self, run_query, *args, first_page = None):
+        """Yield the result list of every page of a search in page order.
+
+        Page 1 is fetched first to read pages/totalCount (unless already given as first_page), the remaining pages are fetched concurrently.
+        """
+        search = (first_page or run_query(*args, 1))["data"]["search"]
+        total_number_of_pages = search["pages"]
+        logging.info(f"Found {search['totalCount']} objects on {total_number_of_pages} pages")
+        yield search["result"]
+
+        if total_number_of_pages > 1:
+            with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+                yield from executor.map(
+                    lambda page: run_query(*args, page)["data"]["search"]["result"],
+                    range(2, total_number_of_pages + 1)
+                )
+
+    def fetch_all_pages(self, run_query, *args, first_page = None):
+        return [object for page in self.iter_pages(run_query, *args, first_page = first_page) for object in page]
+
+    def run_query_sold_shard(self, shard, page, fields = None):
+        return self.run_query_sold(shard["objectType"], shard["minSoldDate"], shard["maxSoldDate"], shard["rooms"], "", "", "", shard["areaId"], page, fields)
+
+    def run_query_upcoming_shard(self, shard, page, fields = None):
+        return self.run_query_upcoming(shard["objectType"], shard["rooms"], shard["areaId"], page, fields)
+
+    def split_rooms_shard(self, shard, rooms_splits = ("1", "2", "3", "4", "5")):
+        """Split a shard that isn't filtered on rooms yet by number of rooms, see check_split for the coverage."""
+        if shard["rooms"] == "":
+            return [{**shard, "rooms": rooms} for rooms in rooms_splits]
+        return []
+
+    def split_sold_shard(self, shard, rooms_splits = ("1", "2", "3", "4", "5")):
+        """Split a shard in two halves by sold date, or by rooms once it only covers a single day."""
+        min_sold_date = date.fromisoformat(shard["minSoldDate"])
+        max_sold_date = date.fromisoformat(shard["maxSoldDate"])
         
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception("Query failed to run: {} - {}".format(response.status_code, response.json()))
+        if max_sold_date > min_sold_date:
+            middle = min_sold_date + (max_sold_date - min_sold_date) // 2
+            return [
+                {**shard, "maxSoldDate": middle.strftime("%Y-%m-%d")},
+                {**shard, "minSoldDate": (middle + timedelta(days = 1)).strftime("%Y-%m-%d")}
+            ]
+        return self.split_rooms_shard(shard, rooms_splits)
+
+    def check_split(self, run_query, shards, total_count):
+        """Return shards if their totalCounts add up to at least the parent's total_count, otherwise an empty list.
+
+        The rooms filter only matches the listed room counts, so listings with e.g. 1.5 or more rooms than the
+        last split would silently be lost. A split that doesn't cover its parent isn't used, the parent is scraped as is.
+        """
+        counts = [run_query(shard, 1, fields = ["booliId"])["data"]["search"]["totalCount"] for shard in shards]
+        if sum(counts) < total_count:
+            logging.warning(f"Split into {len(shards)} shards only covers {sum(counts)} of {total_count} objects, not splitting")
+            return []
+        return shards
         
-    def run_query_sold(self, object_type, minSoldDate, maxSoldDate, rooms, hasBalcony, hasFireplace, hasElevator, area_id, page):
-        payload = """{    
-            "operationName": "searchSold",    
+    def build_selection(self, fields):
+        """Turn dotted field names into a GraphQL selection set, e.g. ["soldPrice.raw", "url"] -> "soldPrice {raw} url"."""
+        tree = {}
+        for field in fields:
+            node = tree
+            for key in field.split("."):
+                node = node.setdefault(key, {})
+
+        def render(node):
+            return " ".join(key + (" {" + render(child) + "}" if child else "") for key, child in node.items())
+        return render(tree)
+
+    def build_query(self, operation_name, filters, fields, area_id, page, sort, ascending = False, result_type = None):
+        """Build a json encoded search payload selecting only the given fields."""
+        selection = self.build_selection(fields)
+        if result_type is not None:
+            selection = f"__typename ... on {result_type} {{ {selection} }}"
+        query = f"query {operation_name}($input: SearchRequest) {{ search: {operation_name}(input: $input) {{ pages totalCount result {{ {selection} }} }} }}"
+        return json.dumps({
+            "operationName": operation_name,
             "variables": {
-                "input": {            
-                    "filters": [                
-                        {                    
-                            "key": "objectType",
-                            "value": "%s"                
-                        },
-                        {
-					        "key": "minSoldDate",
-					        "value": "%s"
-				        },
-                        {
-                            "key": "maxSoldDate",
-                            "value": "%s"
-                        },                
-                        {                    
-                            "key": "rooms",                    
-                            "value": "%s"                
-                        },
-                         {                    
-                            "key": "hasBalcony",                    
-                            "value": "%s"                
-                        },
-                        {                    
-                            "key": "hasFireplace",                    
-                            "value": "%s"                
-                        },
-                        {                    
-                            "key": "hasElevator",                    
-                            "value": "%s"                
-                        }
-                    ],        
-                    "areaId": "%s",        
-                    "sort": "created",        
-                    "page": %s,        
-                    "ascending": false        
-                }    
-            },    
-            "query": "query searchSold($input: SearchRequest) {  search: searchSold(input: $input) {    pages    totalCount    result {      booliId      soldPrice {raw}   rent{raw}   streetAddress       constructionYear       floor{raw}      soldSqmPrice {raw}      soldPriceAbsoluteDiff {raw}      soldPricePercentageDiff {raw}      listPrice {raw}      livingArea {raw}      rooms {raw}      rooms {raw}      objectType      descriptiveAreaName      soldPriceType      daysActive      soldDate      latitude      longitude      url      __typename    }    __typename  }}"    
-        }"""
-        headers = {
-            'authority': "www.booli.se",
-            'accept': "*/*",
-            'accept-language': "sv,en;q=0.9,en-GB;q=0.8,en-US;q=0.7",
-            'api-client': "booli.se",
-            'content-type': "application/json",
-            'origin': "https://www.booli.se",
-            'sec-ch-ua-mobile': "?0",
-            'sec-ch-ua-platform': "Windows",
-            'sec-fetch-dest': "empty",
-            'sec-fetch-mode': "cors",
-            'sec-fetch-site': "same-origin",
-            'user-agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.5060.134 Safari/537.36 Edg/103.0.1264.77"
-        }
-        response = requests.post(self.path, data = payload % (object_type, minSoldDate, maxSoldDate, rooms, hasBalcony, hasFireplace, hasElevator, area_id, page), headers=headers) # Throws 400
+                "input": {
+                    "filters": [{"key": key, "value": str(value)} for key, value in filters.items()],
+                    "areaId": str(area_id),
+                    "sort": sort,
+                    "page": page,
+                    "ascending": ascending
+                }
+            },
+            "query": query
+        })
+
+    def project_fields(self, field_types, fields):
+        """Subset of the field types for the selected fields, used as Parquet schema."""
+        return {field: field_types[field] for field in fields}
+
+    def post_query(self, payload):
+        response = self.session.post(self.path, data = payload, headers = self.headers)
         
         if response.status_code == 200:
             return response.json()
         else:
-            raise Exception("Query failed to run: {} - {}".format(response.status_code, response.json()))
+            raise Exception("Query failed to run: {} - {}".format(response.status_code, response.text))
+
+    def run_query_upcoming(self, object_type, rooms, area_id, page, fields = None):
+        filters = {
+            "objectType": object_type,
+            "rooms": rooms,
+            "isNewConstruction": "",
+            "priceDecrease": "",
+            "upcomingSale": ""
+        }
+        payload = self.build_query("searchForSale", filters, fields or self.upcoming_selected_fields, area_id, page, "published", result_type = "Listing")
+        return self.post_query(payload)
+        
+    def run_query_sold(self, object_type, minSoldDate, maxSoldDate, rooms, hasBalcony, hasFireplace, hasElevator, area_id, page, fields = None):
+        filters = {
+            "objectType": object_type,
+            "minSoldDate": minSoldDate,
+            "maxSoldDate": maxSoldDate,
+            "rooms": rooms,
+            "hasBalcony": hasBalcony,
+            "hasFireplace": hasFireplace,
+            "hasElevator": hasElevator
+        }
+        payload = self.build_query("searchSold", filters, fields or self.sold_selected_fields, area_id, page, "created")
+        return self.post_query(payload)
+        
+class ParquetStreamWriter:
+    """Flatten pages of GraphQL results into a fixed Arrow schema and append each page as a Parquet row group."""
+    def __init__(self, fields):
+        self.schema = pa.schema(list(fields.items()))
+        self.buffer = BytesIO()
+        self.writer = pq.ParquetWriter(self.buffer, self.schema, compression = "snappy")
+        self.num_rows = 0
+
+    def get_field(self, object, field):
+        for key in field.split("."):
+            if not isinstance(object, dict):
+                return None
+            object = object.get(key)
+        return object
+
+    def convert_value(self, value, field_type):
+        if value is None:
+            return None
+        if pa.types.is_integer(field_type):
+            return int(value)
+        if pa.types.is_floating(field_type):
+            return float(value)
+        if pa.types.is_string(field_type):
+            return str(value)
+        return value
+
+    def write_page(self, objects):
+        if not objects:
+            return
+        columns = {
+            field.name: [self.convert_value(self.get_field(object, field.name), field.type) for object in objects]
+            for field in self.schema
+        }
+        self.writer.write_table(pa.Table.from_pydict(columns, schema = self.schema))
+        self.num_rows += len(objects)
+
+    def close(self):
+        """Finish the file and return it as bytes."""
+        self.writer.close()
+        return self.buffer.getvalue()
+
+
+class BlobManifest:
+    """Name and ETag of every blob that has already been processed, stored as a json blob."""
+    def __init__(self, azure_utils, container, blob_name = "_manifest.json"):
+        self.azure_utils = azure_utils
+        self.container = container
+        self.blob_name = blob_name
+        self.processed = {}
+
+    def load(self):
+        self.processed = self.azure_utils.download_json_blob(self.container, self.blob_name) or {}
+        return self.processed
+
+    def get_new_blobs(self, blob_list):
+        """Blobs that are new or have changed (different ETag) since they were processed."""
+        return [blob for blob in blob_list if self.processed.get(blob.name) != blob.etag]
+
+    def save(self, blob_list):
+        self.processed.update({blob.name: blob.etag for blob in blob_list})
+        return self.azure_utils.upload_json_blob(self.processed, self.container, self.blob_name)
+
+
+class SoldCheckpoint:
+    """High-water mark of the latest scraped sold listing for one (objectType, areaId) segment."""
+    def __init__(self, azure_utils, object_type, area_id, container = "raw/checkpoints"):
+        self.azure_utils = azure_utils
+        self.container = container
+        self.blob_name = f"sold_{object_type}_{area_id}.json"
+        self.watermark = None
+        self.latest = None
+
+    def load(self):
+        self.watermark = self.azure_utils.download_json_blob(self.container, self.blob_name)
+        return self.watermark
+
+    def get_min_sold_date(self, overlap_days = 7, initial_days = 31):
+        """Start of the next query window, overlap_days before the watermark to catch late-reported sales."""
+        watermark = self.load()
+        if watermark is None:
+            logging.info(f"No checkpoint {self.blob_name} found, scraping the last {initial_days} days")
+            return (datetime.utcnow() - timedelta(days = initial_days)).strftime("%Y-%m-%d")
         
+        logging.info(f"Resuming from checkpoint {watermark}")
+        return (date.fromisoformat(watermark["soldDate"][:10]) - timedelta(days = overlap_days)).strftime("%Y-%m-%d")
+
+    def observe(self, objects):
+        """Keep track of the latest soldDate/booliId among the scraped objects."""
+        for object in objects:
+            key = (object["soldDate"], int(object["booliId"]))
+            if self.latest is None or key > self.latest:
+                self.latest = key
+
+    def save(self):
+        """Advance the watermark to the latest observed soldDate/booliId."""
+        if self.latest is not None:
+            self.advance(*self.latest)
+
+    def advance(self, sold_date, booli_id = 0):
+        watermark = self.watermark
+        if watermark is not None and (watermark["soldDate"], watermark["booliId"]) >= (sold_date, booli_id):
+            return
+        
+        self.watermark = {"soldDate": sold_date, "booliId": booli_id}
+        self.azure_utils.upload_json_blob(self.watermark, self.container, self.blob_name)
+
+
+class SoldShardRun:
+    """Completion markers for the shards of one sold fan-out, the checkpoint is only advanced once every shard is scraped."""
+    def __init__(self, azure_utils, shard, container = "raw"):
+        self.azure_utils = azure_utils
+        self.container = container
+        self.prefix = f"checkpoints/runs/sold_{shard['objectType']}_{shard['areaId']}/{shard['runId']}/"
+
+    @staticmethod
+    def get_shard_id(shard):
+        return f"{shard['minSoldDate']}_{shard['maxSoldDate']}_{shard['rooms'] or 'all'}"
+
+    def record_split(self, shard, children):
+        """Written before the children are queued so a run is never seen as complete while they are pending."""
+        children_ids = [self.get_shard_id(child) for child in children]
+        if not self.azure_utils.upload_json_blob(children_ids, self.container, f"{self.prefix}split/{self.get_shard_id(shard)}.json"):
+            raise IOError(f"Failed to record split of shard {self.get_shard_id(shard)}")
+
+    def record_done(self, shard):
+        if not self.azure_utils.upload_json_blob({}, self.container, f"{self.prefix}done/{self.get_shard_id(shard)}.json"):
+            raise IOError(f"Failed to record completion of shard {self.get_shard_id(shard)}")
+
+    def is_complete(self, root_shard_id):
+        done = set()
+        splits = {}
+        for blob in self.azure_utils.list_blobs(self.container, self.prefix):
+            kind, name = blob.name[len(self.prefix):].split("/", 1)
+            shard_id = name[:-len(".json")]
+            if kind == "done":
+                done.add(shard_id)
+            elif kind == "split":
+                splits[shard_id] = self.azure_utils.download_json_blob(self.container, blob.name)
+
+        def complete(shard_id):
+            if shard_id in done:
+                return True
+            return shard_id in splits and all(complete(child_id) for child_id in splits[shard_id])
+        return complete(root_shard_id)
+
 
 #Structure created by Sarah Floris
 class DataCleaning:
@@ -257,7 +673,7 @@ class DataCleaning:
     
     def drop_dataframe_columns(self, df, columns):
         try:
-            return df.drop(columns, axis = 1)
+            return df.drop(columns, axis = 1, errors = "ignore")
         except Exception as e:
             logging.error(f"Failed to drop columns {columns}: {e}")
 
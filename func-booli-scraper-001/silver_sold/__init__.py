@@ -23,16 +23,26 @@ def main(mytimer: func.TimerRequest) -> None:
     columns_to_drop = ["floor", "soldPriceAbsoluteDiff", "soldPricePercentageDiff", "listPrice", "rooms", "soldSqmPrice", "livingArea", "Unnamed: 0"]
     non_numeric_columns = ["streetAddress", "objectType", "descriptiveAreaName", "soldPriceType", "soldDate", "url", "__typename"]
 
-    df_cleaning = (
-        azure_utils.ingest_raw_data(f"Sold_")
-        .pipe(data_cleaning.drop_dataframe_columns, columns_to_drop)
-        .pipe(data_cleaning.set_dtype_to_numeric, non_numeric_columns)
-        .pipe(data_cleaning.change_timestamp_format, "soldDate")
-    )
+    # Only read raw blobs that haven't been processed before (new name or changed ETag)
+    manifest = utils.BlobManifest(azure_utils, "silver/sold")
+    manifest.load()
+    new_blobs = manifest.get_new_blobs(list(azure_utils.list_blobs("raw", "sold/all/Sold_")))
     
-    parquet_file = df_cleaning.to_parquet(index = False)
-
-    azure_utils.upload_csv_to_datalake(parquet_file, "silver/sold", f"Sold_{date.today()}.parquet")   
+    if new_blobs:
+        logging.info(f"Processing {len(new_blobs)} new raw blobs")
+        df_cleaning = (
+            azure_utils.ingest_raw_blobs(new_blobs)
+            .pipe(data_cleaning.drop_dataframe_columns, columns_to_drop)
+            .pipe(data_cleaning.set_dtype_to_numeric, non_numeric_columns)
+            .pipe(data_cleaning.change_timestamp_format, "soldDate")
+        )
+        
+        # Append listings that aren't in the silver dataset yet as a new Sold_{n}.parquet part, existing parts are never rewritten
+        rows_appended = azure_utils.append_new_rows(df_cleaning, "silver", "sold", "Sold", ["booliId"])
+        logging.info(f"Appended {rows_appended} new listings to silver/sold")
+        manifest.save(new_blobs)
+    else:
+        logging.info("No new raw blobs to process")
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
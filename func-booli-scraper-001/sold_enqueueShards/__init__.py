@@ -0,0 +1,46 @@
+import datetime
+import logging
+import json
+import os
+import azure.functions as func
+
+from shared_code import utils
+
+def main(mytimer: func.TimerRequest) -> None:
+    area_ids = os.getenv("BOOLI_AREA_IDS", "143").split(",")
+    object_types = os.getenv("BOOLI_OBJECT_TYPES", "Lägenhet").split(",")
+    overlap_days = int(os.getenv("BOOLI_SOLD_OVERLAP_DAYS", 7))
+    maxSoldDate = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+    run_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    
+    azure_utils = utils.AzureUtils()
+    secret_client = azure_utils.initialize_key_vault()
+    sa_secret = azure_utils.get_key_vault_secret(secret_client, 'sa-booli')
+    sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
+    azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
+    azure_utils.initialize_queue_client(os.getenv("AzureWebJobsStorage"), "booli-sold-shards")
+
+    # One shard per (areaId, objectType), the workers split them further if they are too big.
+    # The checkpoint is advanced by the worker that completes the last shard of the run.
+    for area_id in area_ids:
+        for object_type in object_types:
+            checkpoint = utils.SoldCheckpoint(azure_utils, object_type, area_id)
+            shard = {
+                "areaId": area_id,
+                "objectType": object_type,
+                "rooms": "",
+                "minSoldDate": checkpoint.get_min_sold_date(overlap_days),
+                "maxSoldDate": maxSoldDate,
+                "runId": run_id,
+                "runMaxSoldDate": maxSoldDate
+            }
+            shard["rootShardId"] = utils.SoldShardRun.get_shard_id(shard)
+            azure_utils.send_queue_message(json.dumps(shard))
+    
+    utc_timestamp = datetime.datetime.utcnow().replace(
+        tzinfo=datetime.timezone.utc).isoformat()
+
+    if mytimer.past_due:
+        logging.info('The timer is past due!')
+
+    logging.info('Python timer trigger function ran at %s', utc_timestamp)
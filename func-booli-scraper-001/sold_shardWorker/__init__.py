@@ -0,0 +1,60 @@
+import logging
+import json
+import os
+import azure.functions as func
+
+from datetime import date
+from shared_code import utils
+
+def main(msg: func.QueueMessage) -> None:
+    shard = json.loads(msg.get_body().decode("utf-8"))
+    logging.info('Python queue trigger function processed a queue item: %s', shard)
+    max_shard_objects = int(os.getenv("BOOLI_MAX_SHARD_OBJECTS", 2000))
+    
+    azure_utils = utils.AzureUtils()
+    secret_client = azure_utils.initialize_key_vault()
+    sa_secret = azure_utils.get_key_vault_secret(secret_client, 'sa-booli')
+    sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
+    azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
+
+    booli_utils = utils.Booli()
+    first_page = booli_utils.run_query_sold_shard(shard, 1)
+    total_number_of_objects = first_page["data"]["search"]["totalCount"]
+
+    # Too big to page through comfortably, split and let other workers pick up the halves
+    if total_number_of_objects > max_shard_objects:
+        shards = booli_utils.split_sold_shard(shard)
+        if shards:
+            shards = booli_utils.check_split(booli_utils.run_query_sold_shard, shards, total_number_of_objects)
+        if shards:
+            logging.info(f"Splitting shard with {total_number_of_objects} objects into {len(shards)} shards")
+            if "runId" in shard:
+                utils.SoldShardRun(azure_utils, shard).record_split(shard, shards)
+            azure_utils.initialize_queue_client(os.getenv("AzureWebJobsStorage"), "booli-sold-shards")
+            for child_shard in shards:
+                azure_utils.send_queue_message(json.dumps(child_shard))
+            return
+        logging.warning(f"Shard {shard} can't be split without losing objects, scraping {total_number_of_objects} objects")
+
+    writer = utils.ParquetStreamWriter(booli_utils.project_fields(booli_utils.sold_fields, booli_utils.sold_selected_fields))
+    for page in booli_utils.iter_pages(booli_utils.run_query_sold_shard, shard, first_page = first_page):
+        writer.write_page(page)
+    parquet_file = writer.close()
+    logging.info(f"Total number of objects stored {writer.num_rows} / {total_number_of_objects}")
+
+    if writer.num_rows > 0:
+        blob_name = f"Sold_{shard['objectType']}_{shard['rooms']}_{shard['areaId']}_{shard['minSoldDate']}_{shard['maxSoldDate']}_{date.today()}.parquet"
+        if not azure_utils.upload_blob(parquet_file, "raw/sold/all", blob_name):
+            # Fail the message so it's retried, the shard isn't marked done
+            raise IOError(f"Failed to upload {blob_name}")
+
+    # Messages queued before runs were tracked carry no runId and don't move the checkpoint
+    if "runId" not in shard:
+        return
+    run = utils.SoldShardRun(azure_utils, shard)
+    run.record_done(shard)
+    if run.is_complete(shard["rootShardId"]):
+        logging.info(f"All shards of run {shard['runId']} are done, advancing checkpoint to {shard['runMaxSoldDate']}")
+        checkpoint = utils.SoldCheckpoint(azure_utils, shard["objectType"], shard["areaId"])
+        checkpoint.load()
+        checkpoint.advance(shard["runMaxSoldDate"])
@@ -1,6 +1,7 @@
 import datetime
 import logging
 import time
+import os
 import azure.functions as func
 import pandas as pd
 
@@ -9,9 +10,7 @@ from shared_code import utils
 
 def main(mytimer: func.TimerRequest) -> None:
     object_type = "Lägenhet"
-    currentDateTime = datetime.datetime.utcnow() - timedelta(days = 31)
-    currentDate = currentDateTime.strftime("%Y-%m-%d")
-    minSoldDate = currentDate
+    overlap_days = int(os.getenv("BOOLI_SOLD_OVERLAP_DAYS", 7))
     maxSoldDate = datetime.datetime.utcnow().strftime("%Y-%m-%d")
     rooms = ""
     hasBalcony = ""
@@ -25,29 +24,23 @@ def main(mytimer: func.TimerRequest) -> None:
     sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
     storage_account = azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
 
-    booli_utils = utils.Booli()
+    # Only query from the stored watermark forward, with an overlap for late-reported sales
+    checkpoint = utils.SoldCheckpoint(azure_utils, object_type, area_id)
+    minSoldDate = checkpoint.get_min_sold_date(overlap_days)
 
-    data = booli_utils.run_query_sold(object_type, minSoldDate, maxSoldDate, rooms, hasBalcony, hasFireplace, hasElevator, area_id, 1)
-    total_number_of_pages = data["data"]["search"]["pages"]
-    total_number_of_objects = data["data"]["search"]["totalCount"]
-    total_number_of_pages
+    booli_utils = utils.Booli()
 
-    res = []
-    for page in range(1, total_number_of_pages + 1):
-        print(f'Scraping page: {page} / {total_number_of_pages}')
-        data = booli_utils.run_query_sold(object_type, minSoldDate, maxSoldDate, rooms, hasBalcony, hasFireplace, hasElevator, area_id, page)
-        
-        for object in data["data"]["search"]["result"]:
-            res.append(object)
-        
-        print(f"Total number of objects stored {len(res)} / {total_number_of_objects}")
-        print("")
-        print("--------------------------------------------")
-        print("")
-        
-    df = pd.json_normalize(res)
+    # Append every page as a row group as soon as it arrives instead of collecting all results first
+    writer = utils.ParquetStreamWriter(booli_utils.project_fields(booli_utils.sold_fields, booli_utils.sold_selected_fields))
+    for page in booli_utils.iter_pages(booli_utils.run_query_sold, object_type, minSoldDate, maxSoldDate, rooms, hasBalcony, hasFireplace, hasElevator, area_id):
+        writer.write_page(page)
+        checkpoint.observe(page)
+    parquet_file = writer.close()
+    logging.info(f"Total number of objects stored {writer.num_rows}")
     
-    azure_utils.upload_csv_to_datalake(df, "raw/sold/all", f"Sold_{object_type}_{rooms}_{area_id}_{date.today()}.csv")
+    if writer.num_rows > 0:
+        if azure_utils.upload_blob(parquet_file, "raw/sold/all", f"Sold_{object_type}_{rooms}_{area_id}_{date.today()}.parquet"):
+            checkpoint.save()
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
@@ -0,0 +1,32 @@
+import datetime
+import logging
+import json
+import os
+import azure.functions as func
+
+from shared_code import utils
+
+def main(mytimer: func.TimerRequest) -> None:
+    area_ids = os.getenv("BOOLI_AREA_IDS", "143").split(",")
+    object_types = os.getenv("BOOLI_OBJECT_TYPES", "Lägenhet").split(",")
+    
+    azure_utils = utils.AzureUtils()
+    azure_utils.initialize_queue_client(os.getenv("AzureWebJobsStorage"), "booli-upcoming-shards")
+
+    # One shard per (areaId, objectType), the workers split them by rooms if they are too big
+    for area_id in area_ids:
+        for object_type in object_types:
+            shard = {
+                "areaId": area_id,
+                "objectType": object_type,
+                "rooms": ""
+            }
+            azure_utils.send_queue_message(json.dumps(shard))
+    
+    utc_timestamp = datetime.datetime.utcnow().replace(
+        tzinfo=datetime.timezone.utc).isoformat()
+
+    if mytimer.past_due:
+        logging.info('The timer is past due!')
+
+    logging.info('Python timer trigger function ran at %s', utc_timestamp)
@@ -20,20 +20,12 @@ def main(mytimer: func.TimerRequest) -> None:
 
     booli_utils = utils.Booli()
 
-    data = booli_utils.run_query_upcoming(object_type, rooms, area_id, 1)
-    total_number_of_pages = data["data"]["search"]["pages"]
-    total_number_of_pages
+    writer = utils.ParquetStreamWriter(booli_utils.upcoming_fields)
+    for page in booli_utils.iter_pages(booli_utils.run_query_upcoming, object_type, rooms, area_id):
+        writer.write_page(page)
+    parquet_file = writer.close()
     
-    res = []
-    for page in range(1, total_number_of_pages + 1):
-        data = booli_utils.run_query_upcoming(object_type, rooms, area_id, page)
-        
-        for object in data["data"]["search"]["result"]:
-            res.append(object)
-
-    df = pd.json_normalize(res)
-    
-    azure_utils.upload_csv_to_datalake(df, "raw/upcoming", f"Upcoming_{object_type}_{rooms}_{area_id}_{date.today()}.csv")
+    azure_utils.upload_blob(parquet_file, "raw/upcoming", f"Upcoming_{object_type}_{rooms}_{area_id}_{date.today()}.parquet")
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
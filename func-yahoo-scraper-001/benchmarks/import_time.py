@@ -0,0 +1,53 @@
+"""Measure the cold import time of the shared code, one fresh interpreter per module.
+
+Run from the function app root:
+
+    python benchmarks/import_time.py [--runs 5] [--max-ms 1500]
+
+Prints the median wall-clock import time per module and exits with 1 when any module is slower than --max-ms,
+so cold-start regressions show up before deployment.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    "shared_code.utils",
+    "shared_code.storage",
+    "shared_code.scraping",
+    "shared_code.fundamentals",
+    "shared_code.cleaning",
+]
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module):
+    """Import module in a new interpreter and return the import time in milliseconds."""
+    code = f"import time; start = time.perf_counter(); import {module}; print((time.perf_counter() - start) * 1000)"
+    output = subprocess.run([sys.executable, "-c", code], cwd = APP_ROOT, capture_output = True, text = True, check = True)
+    return float(output.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type = int, default = 5)
+    parser.add_argument("--max-ms", type = float, default = None)
+    args = parser.parse_args()
+
+    too_slow = []
+    for module in MODULES:
+        median = statistics.median(time_import(module) for _ in range(args.runs))
+        print(f"{module:<28} {median:8.1f} ms")
+        if args.max_ms is not None and median > args.max_ms:
+            too_slow.append(module)
+
+    if too_slow:
+        print(f"Slower than {args.max_ms} ms: {', '.join(too_slow)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
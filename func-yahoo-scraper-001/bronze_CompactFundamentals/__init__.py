@@ -0,0 +1,34 @@
+import datetime
+import logging
+import os
+
+import azure.functions as func
+from shared_code import utils
+
+# Datasets written per ticker by the bronze fundamentals functions, PiotroskiScore only holds older history
+DATASETS = ["IncomeStatement", "BalanceSheet", "CashFlow", "ValuationMeasure", "AssetProfile", "FinancialData", "PiotroskiScore"]
+
+def main(mytimer: func.TimerRequest) -> None:
+
+    try:
+        azure_utils = utils.AzureUtils()
+
+        sa_secret = os.getenv("AZURE_STORAGE_SECRET")
+        sa_name = os.getenv("AZURE_STORAGE_NAME")
+        azure_utils.initialize_storage_account_ad(sa_secret, sa_name)
+
+        # Merge the per-ticker files of every finished day into a few large files, today's folder is still being written
+        for dataset in DATASETS:
+            compacted = azure_utils.compact_daily_directories("bronze", f"{dataset}/")
+            logging.info(f'Compacted {compacted} {dataset} blobs')
+
+    except Exception as e:
+        logging.error(f'Error occurred: {str(e)}')
+
+    utc_timestamp = datetime.datetime.utcnow().replace(
+        tzinfo=datetime.timezone.utc).isoformat()
+
+    if mytimer.past_due:
+        logging.info('The timer is past due!')
+
+    logging.info('Python timer trigger function ran at %s', utc_timestamp)
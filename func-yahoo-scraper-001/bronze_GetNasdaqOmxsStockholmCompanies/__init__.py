@@ -13,7 +13,6 @@ from shared_code import utils
 def main(mytimer: func.TimerRequest) -> None:
     try:
         azure_utils = utils.AzureUtils()
-        secret_client = azure_utils.initialize_key_vault()
         
         sa_secret = os.getenv("AZURE_STORAGE_SECRET")#azure_utils.get_key_vault_secret(secret_client, 'sa-secret')
         sa_name = os.getenv("AZURE_STORAGE_NAME")#azure_utils.get_key_vault_secret(secret_client, 'sa-name')
@@ -38,8 +37,7 @@ def main(mytimer: func.TimerRequest) -> None:
 def upload_companies_data(companies, azure_utils):
     """Upload companies data to Azure Blob Storage and send company tickers to Azure Queue."""
     try:
-        for ticker in companies.tickers:
-            azure_utils.send_queue_message(ticker)
+        azure_utils.send_ticker_batches(companies.tickers)
         
         parquet_file = companies.to_parquet(index = False)
         azure_utils.upload_blob(parquet_file, "bronze/companies/nasdaqOmxStockholm", "companies_nasdaqOmxsStockholm.parquet")
@@ -12,55 +12,45 @@ from shared_code import utils
 def main(msg: func.QueueMessage) -> None:
     
     try:
-        ticker = msg.get_body().decode("utf-8")
-        logging.info('Python queue trigger function processed a queue item: %s', ticker)
+        message = msg.get_body().decode("utf-8")
+        logging.info('Python queue trigger function processed a queue item: %s', message)
 
         # Initialize Azure Utils
         azure_utils = utils.AzureUtils()
-        secret_client = azure_utils.initialize_key_vault()
 
         sa_secret = os.getenv("AZURE_STORAGE_SECRET")#azure_utils.get_key_vault_secret(secret_client, 'sa-secret')
         sa_name = os.getenv("AZURE_STORAGE_NAME")#azure_utils.get_key_vault_secret(secret_client, 'sa-name')
         azure_utils.initialize_storage_account_ad(sa_secret, sa_name)
 
-        # Get financials data and upload to Blob Storage
-        fetch_and_upload_financials(ticker, azure_utils)
+        # Get financials data and upload to Blob Storage, a message holds a batch of tickers
+        # Fetch the whole batch with one multi-symbol request, tickers missing from it are fetched one by one
+        tickers = azure_utils.get_tickers_from_message(message)
+        batch = utils.StockFundamentalsBatch(tickers)
+        batch.fetch_data()
+        # Rows of all tickers are buffered per dataset and uploaded as a few larger files
+        with utils.BronzeWriter(azure_utils, "sp500") as bronze_writer:
+            for ticker in tickers:
+                fetch_and_upload_financials(ticker, bronze_writer, batch.get_stock(ticker))
 
     except Exception as e:
         logging.error(f'Error occurred: {str(e)}')
+        # Fail the message so the runtime retries it, otherwise the rows of a failed bronze upload are lost
+        raise
         
-def fetch_and_upload_financials(ticker, azure_utils):
-    all_scores = []
-    
+def fetch_and_upload_financials(ticker, bronze_writer, stock = None):
     try:
-        stock = utils.StockFundamentals(ticker)
-        
-        calculator = utils.PiotroskiScoreCalculator(stock)
-        scores = calculator.calculate_score()
-        scores['Ticker'] = ticker  # add a column for the ticker
-        all_scores.append(scores)
-        scores_df = pd.concat(all_scores)
-        
-        parquet_file = stock.income_statement.reset_index().to_parquet(index = False)
-        azure_utils.upload_blob(parquet_file, f"bronze/IncomeStatement/sp500/{date.today()}", f"IncomeStatement_{ticker}.parquet")
-        
-        parquet_file = stock.balance_sheet.reset_index().to_parquet(index = False)
-        azure_utils.upload_blob(parquet_file, f"bronze/BalanceSheet/sp500/{date.today()}", f"BalanceSheet_{ticker}.parquet")
-        
-        parquet_file = stock.cash_flow.reset_index().to_parquet(index = False)
-        azure_utils.upload_blob(parquet_file, f"bronze/CashFlow/sp500/{date.today()}", f"CashFlow_{ticker}.parquet")
-        
-        parquet_file = stock.valuation_measure.reset_index().to_parquet(index = False)
-        azure_utils.upload_blob(parquet_file, f"bronze/ValuationMeasure/sp500/{date.today()}", f"ValuationMeasure_{ticker}.parquet")
-        
-        parquet_file = scores_df.reset_index().to_parquet(index = False)
-        azure_utils.upload_blob(parquet_file, f"bronze/PiotroskiScore/sp500/{date.today()}", f"PiotroskiScore_{ticker}.parquet")
-        
-        parquet_file = stock.asset_profile.reset_index().to_parquet(index = False)
-        azure_utils.upload_blob(parquet_file, f"bronze/AssetProfile/sp500/{date.today()}", f"AssetProfile_{ticker}.parquet")
-        
-        parquet_file = stock.financial_data.reset_index().to_parquet(index = False)
-        azure_utils.upload_blob(parquet_file, f"bronze/FinancialData/sp500/{date.today()}", f"FinancialData_{ticker}.parquet")
+        stock = stock or utils.StockFundamentals(ticker)
+        if stock.income_statement is None:
+            stock.fetch_data()
     
     except Exception as e:
-        logging.error(f'Error occurred while fetching and uploading financials data: {str(e)}')
+        logging.error(f'Error occurred while fetching financials data: {str(e)}')
+        return
+
+    # Upload errors aren't caught here, a flush also holds the buffered rows of other tickers
+    bronze_writer.write("IncomeStatement", stock.income_statement.reset_index())
+    bronze_writer.write("BalanceSheet", stock.balance_sheet.reset_index())
+    bronze_writer.write("CashFlow", stock.cash_flow.reset_index())
+    bronze_writer.write("ValuationMeasure", stock.valuation_measure.reset_index())
+    bronze_writer.write("AssetProfile", stock.asset_profile.reset_index())
+    bronze_writer.write("FinancialData", stock.financial_data.reset_index())
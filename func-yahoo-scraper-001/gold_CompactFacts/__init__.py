@@ -0,0 +1,40 @@
+import datetime
+import logging
+
+import azure.functions as func
+from shared_code import utils
+
+# Gold tables written by upsert_fact and their keys, the Power BI report only reads the single {name}.parquet file
+FACT_TABLES = {
+    "dimcompany/dim_company": ["Ticker"],
+    "factassetprofile/fact_assetProfile": ["Ticker"],
+    "factincomestatement/fact_incomeStatement": ["Ticker", "asOfDate"],
+    "factpiotroski/fact_piotroski": ["Ticker", "Date"],
+    "factpricetarget/fact_priceTarget": ["Ticker", "ObservationDate"],
+    "factvaluation/fact_valuation": ["Ticker", "asOfDate"],
+}
+
+def main(mytimer: func.TimerRequest) -> None:
+
+    azure_utils = utils.AzureUtils()
+
+    secret_client = azure_utils.initialize_key_vault()
+    sa_secret = azure_utils.get_key_vault_secret(secret_client, 'sa-secret')
+    sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
+    azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
+
+    # Merge the parts appended since the last run back into the single file, after the daily gold runs
+    for table, keys in FACT_TABLES.items():
+        try:
+            compacted = azure_utils.compact_fact(table, keys)
+            logging.info(f'Compacted {compacted} parts of {table}')
+        except Exception as e:
+            logging.error(f'Error occurred while compacting {table}: {str(e)}')
+
+    utc_timestamp = datetime.datetime.utcnow().replace(
+        tzinfo=datetime.timezone.utc).isoformat()
+
+    if mytimer.past_due:
+        logging.info('The timer is past due!')
+
+    logging.info('Python timer trigger function ran at %s', utc_timestamp)
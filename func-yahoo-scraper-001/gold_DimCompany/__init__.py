@@ -21,41 +21,50 @@ def main(mytimer: func.TimerRequest) -> None:
     sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
     azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
     
-    dim_company = azure_utils.download_parquet_blob(f"gold/dimcompany", f"dim_company.parquet").drop_duplicates()
-        
+    # Only company lists that changed since the last run are read
+    watermarks = utils.WatermarkStore(azure_utils, "dimcompany")
+    watermark = watermarks.load()
+    companies = []
+    
     # Get Nasdaq Companies
-    df_nasdaq_companies = azure_utils.ingest_bronze_data(f"companies/nasdaqOmxStockholm/").drop_duplicates()
-    df_nasdaq_companies = df_nasdaq_companies[["tickers", "name", "sector"]]
-    df_nasdaq_companies = df_nasdaq_companies.rename({
-        "tickers": "Ticker",
-        "name": "CompanyName",
-        "sector": "Sector"
-    },
-    axis = 1)
-    df_nasdaq_companies["SubSector"] = np.nan
+    blob_list = watermarks.list_new_blobs(watermark, "companies/nasdaqOmxStockholm/")
+    if blob_list:
+        df_nasdaq_companies = azure_utils.ingest_bronze_data(f"companies/nasdaqOmxStockholm/", keys = ["tickers"], blob_list = blob_list)
+        df_nasdaq_companies = df_nasdaq_companies[["tickers", "name", "sector"]]
+        df_nasdaq_companies = df_nasdaq_companies.rename({
+            "tickers": "Ticker",
+            "name": "CompanyName",
+            "sector": "Sector"
+        },
+        axis = 1)
+        # A string column like the S&P 500 sub-industries, a float NaN column would write a double part
+        df_nasdaq_companies["SubSector"] = pd.Series(None, index = df_nasdaq_companies.index, dtype = "string")
+        companies.append(df_nasdaq_companies)
     
     #Get SP500 Companies
-    df_sp500_companies = azure_utils.ingest_bronze_data(f"companies/sp500/").drop_duplicates()
-    df_sp500_companies = df_sp500_companies[["Symbol", "Security", "GICS Sector", "GICS Sub-Industry"]]
-    df_sp500_companies = df_sp500_companies.rename({
-        "Symbol": "Ticker",
-        "Security": "CompanyName",
-        "GICS Sector": "Sector",
-        "GICS Sub-Industry": "SubSector"
-    },
-    axis = 1)
+    blob_list = watermarks.list_new_blobs(watermark, "companies/sp500/")
+    if blob_list:
+        df_sp500_companies = azure_utils.ingest_bronze_data(f"companies/sp500/", keys = ["Symbol"], blob_list = blob_list)
+        df_sp500_companies = df_sp500_companies[["Symbol", "Security", "GICS Sector", "GICS Sub-Industry"]]
+        df_sp500_companies = df_sp500_companies.rename({
+            "Symbol": "Ticker",
+            "Security": "CompanyName",
+            "GICS Sector": "Sector",
+            "GICS Sub-Industry": "SubSector"
+        },
+        axis = 1)
+        companies.insert(0, df_sp500_companies)
     
-    # Union and set index
-    df_company = pd.concat([df_sp500_companies, df_nasdaq_companies], axis = 0)
-    df_company = df_company.set_index("Ticker")
+    if not companies:
+        logging.info('No new company lists since the last run')
+        return
     
-    # Add rows that doesn't already exist in dim_company
-    dim_company = dim_company.set_index("Ticker")
-    dim_company = pd.concat([df_company[~df_company.index.isin(dim_company.index)], dim_company]).reset_index()
+    # Union
+    df_company = pd.concat(companies, axis = 0)
     
-    parquet_file = dim_company.to_parquet(index = False)
-
-    azure_utils.upload_blob(parquet_file, "gold/dimcompany", "dim_company.parquet")
+    # Add rows that doesn't already exist in dim_company
+    azure_utils.upsert_fact("dimcompany/dim_company", ["Ticker"], df_company)
+    watermarks.save(watermark)
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
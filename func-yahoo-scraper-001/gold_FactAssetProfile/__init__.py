@@ -19,9 +19,15 @@ def main(mytimer: func.TimerRequest) -> None:
     sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
     azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
     
-    fact_assetProfile = azure_utils.download_parquet_blob(f"gold/factassetprofile", f"fact_assetProfile.parquet").drop_duplicates()
+    # Only bronze blobs written since the last run are read
+    watermarks = utils.WatermarkStore(azure_utils, "factassetprofile")
+    watermark = watermarks.load()
+    blob_list = watermarks.list_new_blobs(watermark, "AssetProfile/")
+    if not blob_list:
+        logging.info('No new AssetProfile data since the last run')
+        return
     
-    df_AssetProfile = azure_utils.ingest_bronze_data(f"AssetProfile/").drop_duplicates()
+    df_AssetProfile = azure_utils.ingest_bronze_data(f"AssetProfile/", keys = ["index"], blob_list = blob_list)
     
     df_AssetProfile = df_AssetProfile.rename(columns =
         {
@@ -29,13 +35,9 @@ def main(mytimer: func.TimerRequest) -> None:
         }
     )
     
-    fact_assetProfile = fact_assetProfile.set_index(["Ticker"])
-    df_AssetProfile = df_AssetProfile.set_index(["Ticker"])
-    fact_assetProfile = pd.concat([df_AssetProfile[~df_AssetProfile.index.isin(fact_assetProfile.index)], fact_assetProfile]).reset_index()
-    
-    parquet_file = fact_assetProfile.to_parquet(index = False)
-
-    azure_utils.upload_blob(parquet_file, "gold/factassetprofile", "fact_assetProfile.parquet")
+    # Rows with new keys are appended to the fact table as a new part file
+    azure_utils.upsert_fact("factassetprofile/fact_assetProfile", ["Ticker"], df_AssetProfile)
+    watermarks.save(watermark)
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
@@ -20,17 +20,19 @@ def main(mytimer: func.TimerRequest) -> None:
     sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
     azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
     
-    fact_incomeStatement = azure_utils.download_parquet_blob(f"gold/factincomestatement", f"fact_incomeStatement.parquet").drop_duplicates()
+    # Only bronze blobs written since the last run are read
+    watermarks = utils.WatermarkStore(azure_utils, "factincomestatement")
+    watermark = watermarks.load()
+    blob_list = watermarks.list_new_blobs(watermark, "IncomeStatement/")
+    if not blob_list:
+        logging.info('No new IncomeStatement data since the last run')
+        return
     
-    df_IncomeStatement = azure_utils.ingest_bronze_data(f"IncomeStatement/").drop_duplicates()
+    df_IncomeStatement = azure_utils.ingest_bronze_data(f"IncomeStatement/", keys = ["Ticker", "asOfDate"], blob_list = blob_list)
     
-    fact_incomeStatement = fact_incomeStatement.set_index(["Ticker", "asOfDate"])
-    df_IncomeStatement = df_IncomeStatement.set_index(["Ticker", "asOfDate"])
-    fact_incomeStatement = pd.concat([df_IncomeStatement[~df_IncomeStatement.index.isin(fact_incomeStatement.index)], fact_incomeStatement]).reset_index()
-    
-    parquet_file = fact_incomeStatement.to_parquet(index = False)
-
-    azure_utils.upload_blob(parquet_file, "gold/factincomestatement", "fact_incomeStatement.parquet")
+    # Rows with new keys are appended to the fact table as a new part file
+    azure_utils.upsert_fact("factincomestatement/fact_incomeStatement", ["Ticker", "asOfDate"], df_IncomeStatement)
+    watermarks.save(watermark)
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
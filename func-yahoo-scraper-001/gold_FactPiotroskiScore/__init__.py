@@ -21,17 +21,50 @@ def main(mytimer: func.TimerRequest) -> None:
     sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
     azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
     
-    fact_piotroski = azure_utils.download_parquet_blob(f"gold/factpiotroski", f"fact_piotroski.parquet").drop_duplicates()
+    # Scores are computed here from the bronze statements of every ticker, in incremental mode only statements from
+    # PIOTROSKI_LOOKBACK_DAYS before the ticker's newest scored quarter are read (all history for tickers that have no
+    # scores yet), PIOTROSKI_MODE=full scores all history
+    mode = os.getenv("PIOTROSKI_MODE", "incremental")
+    lookback_days = int(os.getenv("PIOTROSKI_LOOKBACK_DAYS", 400))
     
-    df_piotroski = azure_utils.ingest_bronze_data(f"PiotroskiScore/").drop_duplicates()
+    # Scoring needs the previous quarter too, so new bronze data only decides whether the job runs
+    watermarks = utils.WatermarkStore(azure_utils, "factpiotroski")
+    watermark = watermarks.load()
+    new_blobs = [watermarks.list_new_blobs(watermark, directory) for directory in ["IncomeStatement/", "BalanceSheet/", "CashFlow/"]]
+    if mode != "full" and not any(new_blobs):
+        logging.info('No new statements since the last run')
+        return
     
-    fact_piotroski = fact_piotroski.set_index(["Ticker", "Date"])
-    df_piotroski = df_piotroski.set_index(["Ticker", "Date"])
-    fact_piotroski = pd.concat([df_piotroski[~df_piotroski.index.isin(fact_piotroski.index)], fact_piotroski]).reset_index()
-
-    parquet_file = fact_piotroski.to_parquet(index = False)
-
-    azure_utils.upload_blob(parquet_file, f"gold/factpiotroski", f"fact_piotroski.parquet")
+    filters = None
+    cutoffs = None
+    if mode != "full":
+        scored_keys = azure_utils.get_fact_keys("factpiotroski/fact_piotroski", ["Ticker", "Date"])
+        if scored_keys is None or scored_keys.num_rows == 0:
+            logging.info('No existing Piotroski fact table, scoring all history')
+        else:
+            latest = scored_keys.group_by("Ticker").aggregate([("Date", "max")]).to_pandas()
+            cutoffs = pd.Series(pd.to_datetime(latest["Date_max"]).values, index = latest["Ticker"]) - pd.Timedelta(days = lookback_days)
+            # The parquet filter only skips what no ticker needs, the per-ticker cutoff is applied after reading
+            filters = [[("Ticker", "not in", cutoffs.index.tolist())], [("asOfDate", ">=", cutoffs.min())]]
+    
+    statements = {}
+    for statement, directory in [("income_statement", "IncomeStatement/"), ("balance_sheet", "BalanceSheet/"), ("cash_flow", "CashFlow/")]:
+        statements[statement] = azure_utils.ingest_bronze_data(directory, columns = ["Ticker", "asOfDate"] + utils.PIOTROSKI_COLUMNS[statement],
+                                                               keys = ["Ticker", "asOfDate"], filters = filters)
+        if cutoffs is not None:
+            cutoff = statements[statement]["Ticker"].map(cutoffs)
+            statements[statement] = statements[statement][cutoff.isna() | (pd.to_datetime(statements[statement]["asOfDate"]) >= cutoff)]
+        if statements[statement].empty:
+            logging.info(f'No bronze data in {directory}, nothing to score')
+            return
+        statements[statement] = statements[statement].set_index("asOfDate")
+    
+    df_piotroski = utils.calculate_piotroski_scores(statements["income_statement"], statements["balance_sheet"], statements["cash_flow"])
+    df_piotroski = df_piotroski.set_index(["Ticker", "Date"]).reset_index()
+    
+    # Quarters that are already scored are kept, rows with new keys are appended as a new part file
+    azure_utils.upsert_fact("factpiotroski/fact_piotroski", ["Ticker", "Date"], df_piotroski)
+    watermarks.save(watermark)
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
@@ -19,24 +19,26 @@ def main(mytimer: func.TimerRequest) -> None:
     sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
     azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
     
-    fact_priceTarget = azure_utils.download_parquet_blob(f"gold/factpricetarget", f"fact_priceTarget.parquet").drop_duplicates()
+    price_target_columns = ["index", "currentPrice", "numberOfAnalystOpinions", "recommendationKey", "recommendationMean", "targetLowPrice", "targetMeanPrice", "targetMedianPrice"]
+    # Only bronze blobs written since the last run are read
+    watermarks = utils.WatermarkStore(azure_utils, "factpricetarget")
+    watermark = watermarks.load()
+    blob_list = watermarks.list_new_blobs(watermark, "FinancialData/")
+    if not blob_list:
+        logging.info('No new FinancialData since the last run')
+        return
     
-    df_FinancialData = azure_utils.ingest_bronze_data(f"FinancialData/").drop_duplicates()
-    df_priceTargets = df_FinancialData[["currentPrice", "numberOfAnalystOpinions", "recommendationKey", "recommendationMean", "targetLowPrice", "targetMeanPrice", "targetMedianPrice"]].reset_index()
+    df_priceTargets = azure_utils.ingest_bronze_data(f"FinancialData/", columns = price_target_columns, keys = ["index"], blob_list = blob_list)
     df_priceTargets = df_priceTargets.rename(columns =
             {
                 "index": "Ticker"
             }
         )
-    df_priceTargets["observationDate"] = date.today()
+    df_priceTargets["ObservationDate"] = date.today()
     
-    fact_priceTarget = fact_priceTarget.set_index(["Ticker", "ObservationDate"])
-    df_priceTargets = df_priceTargets.set_index(["Ticker", "ObservationDate"])
-    fact_priceTarget = pd.concat([df_priceTargets[~df_priceTargets.index.isin(df_priceTargets.index)], fact_priceTarget]).reset_index()
-    
-    parquet_file = df_priceTargets.to_parquet(index = False)
-
-    azure_utils.upload_blob(parquet_file, "gold/factpricetarget", "fact_priceTarget.parquet")
+    # One observation per ticker and day, rows with new keys are appended to the fact table as a new part file
+    azure_utils.upsert_fact("factpricetarget/fact_priceTarget", ["Ticker", "ObservationDate"], df_priceTargets)
+    watermarks.save(watermark)
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
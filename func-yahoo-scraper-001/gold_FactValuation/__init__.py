@@ -4,6 +4,7 @@ import logging
 import time
 import os
 import pandas as pd
+import pyarrow as pa
 import azure.functions as func
 import numpy as np
 
@@ -21,10 +22,25 @@ def main(mytimer: func.TimerRequest) -> None:
     sa_name = azure_utils.get_key_vault_secret(secret_client, 'sa-name')
     azure_utils.initialize_storage_account_ad(sa_secret.value, sa_name.value)
     
-    fact_valuation = azure_utils.download_parquet_blob(f"gold/factvaluation", f"fact_valuation.parquet").drop_duplicates()
-    dim_company = azure_utils.download_parquet_blob(f"gold/dimcompany", f"dim_company.parquet").drop_duplicates()
+    # Sector statistics are taken per asOfDate, so only the dates that have new bronze data are read
+    watermarks = utils.WatermarkStore(azure_utils, "factvaluation")
+    watermark = watermarks.load()
+    blob_list = watermarks.list_new_blobs(watermark, "ValuationMeasure/")
+    if not blob_list:
+        logging.info('No new ValuationMeasure data since the last run')
+        return
     
-    df_ValuationMeasure = azure_utils.ingest_bronze_data(f"ValuationMeasure/").drop_duplicates()
+    new_dates = azure_utils.ingest_bronze_data("ValuationMeasure/", columns = ["asOfDate"], blob_list = blob_list)
+    if new_dates.empty:
+        watermarks.save(watermark)
+        return
+    # Filter values get the bronze column's arrow type instead of whatever pandas hands back
+    date_type = azure_utils.download_parquet_table("bronze", blob_list[0].name, ["asOfDate"]).schema.field("asOfDate").type
+    filters = [("asOfDate", "in", pa.array(new_dates["asOfDate"].dropna().unique(), type = date_type))]
+    
+    dim_company = azure_utils.read_fact("dimcompany/dim_company").drop_duplicates()
+    
+    df_ValuationMeasure = azure_utils.ingest_bronze_data("ValuationMeasure/", keys = ["symbol", "asOfDate"], filters = filters)
     df_ValuationMeasure = df_ValuationMeasure.rename(columns =
         {
             "symbol": "Ticker"
@@ -32,23 +48,21 @@ def main(mytimer: func.TimerRequest) -> None:
     )
     
     df_valuation = df_ValuationMeasure.merge(dim_company, on = "Ticker")
-        
-    for sector in df_valuation["Sector"].unique():
-        df_valuation.loc[df_valuation['Sector'] == sector, 'MeanSectorPeRatio'] = np.mean(df_valuation[df_valuation['Sector'] == sector]['PeRatio'])
-        df_valuation.loc[df_valuation['Sector'] == sector, 'MeanSectorEvEbitdaRatio'] = np.mean(df_valuation[df_valuation['Sector'] == sector]['EnterprisesValueEBITDARatio'])
-        df_valuation.loc[df_valuation['Sector'] == sector, 'MeanSectorEvRevenueRatio'] = np.mean(df_valuation[df_valuation['Sector'] == sector]['EnterprisesValueRevenueRatio'])
-
-    df_valuation['PeRatioVsSectorMeanInPercent'] = (df_valuation['PeRatio'] / df_valuation['MeanSectorPeRatio'] - 1) * 100
-    df_valuation['EvEbitdaRatioVsSectorMeanInPercent'] = (df_valuation['EnterprisesValueEBITDARatio'] / df_valuation['MeanSectorEvEbitdaRatio'] - 1) * 100
-    df_valuation['EvRevenueRationVsSectorMeanInPercent'] = (df_valuation['EnterprisesValueRevenueRatio'] / df_valuation['MeanSectorEvRevenueRatio']-1)*100
     
-    fact_valuation = fact_valuation.set_index(["Ticker", "asOfDate"])
-    df_valuation = df_valuation.set_index(["Ticker", "asOfDate"])
-    fact_valuation = pd.concat([df_valuation[~df_valuation.index.isin(fact_valuation.index)], fact_valuation]).reset_index()
-
-    parquet_file = fact_valuation.to_parquet(index = False)
-
-    azure_utils.upload_blob(parquet_file, f"gold/factvaluation", f"fact_valuation.parquet")
+    # Peer statistics per (Sector, asOfDate) and, where it's known, per (SubSector, asOfDate)
+    featureEngineering_utils = utils.FeatureEngineering()
+    df_valuation = featureEngineering_utils.add_peer_valuation_statistics(df_valuation, "Sector")
+    if "SubSector" in df_valuation.columns:
+        df_valuation = featureEngineering_utils.add_peer_valuation_statistics(df_valuation, "SubSector")
+    df_valuation = df_valuation.rename(columns =
+        {
+            "EvRevenueRatioVsSectorMeanInPercent": "EvRevenueRationVsSectorMeanInPercent"
+        }
+    )
+    
+    # The statistics of every ticker on these dates changed, so all their rows are replaced, not only new keys
+    azure_utils.replace_fact_rows("factvaluation/fact_valuation", ["Ticker", "asOfDate"], "asOfDate", df_valuation)
+    watermarks.save(watermark)
     
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
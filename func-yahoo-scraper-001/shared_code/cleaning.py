@@ -0,0 +1,76 @@
+import logging
+import pandas as pd
+
+#Structure created by Sarah Floris
+class DataCleaning:
+    def __init__(self):
+        pass
+    
+    def pivot_fundamentals_dataframe(self, df, selected_index = ["Ticker", "ObservationDate"], selected_column = "Attribute", selected_value = "Recent"):
+        try:
+            return df.pivot(index = selected_index, columns = selected_column, values = selected_value).reset_index()
+        except Exception as e:
+            logging.error(f"Couldn't pivot the dataframe: {e}")
+    
+    def select_dataframe_columns(self, df, columns):
+        try:
+            return df[columns]
+        except Exception as e:
+            logging.error(f"Could not select columns {columns}: {e}")
+            
+    def set_dtype_to_numeric(self, df, cols_to_exclude):
+        try:
+            df.loc[:, ~df.columns.isin(cols_to_exclude)] = df.loc[:, ~df.columns.isin(cols_to_exclude)].apply(pd.to_numeric, errors = 'coerce')
+        except Exception as e:
+            logging.error(f"Could not change data type to numeric for all columns except {cols_to_exclude}: {e}")
+        return df
+    
+    def change_timestamp_to_datetime(self, df, column_name):
+        try:
+            df[column_name] = df[column_name].apply(lambda x: pd.to_datetime(x, unit = 's'))
+        except Exception as e:
+            logging.error(f"Could not change timestamp to datetime for column {column_name}: {e}")
+        return df
+    
+    def change_timestamp_format(self, df, column_name, date_format = '%Y-%m-%d'):
+        df[column_name] = df[column_name].apply(lambda x: pd.to_datetime(x, format = date_format))
+        return df
+    
+class FeatureEngineering:
+    # Valuation ratio columns and the names used for the columns derived from them
+    valuation_ratios = {
+        "PeRatio": "PeRatio",
+        "EnterprisesValueEBITDARatio": "EvEbitdaRatio",
+        "EnterprisesValueRevenueRatio": "EvRevenueRatio"
+    }
+    
+    def __init__(self):
+        pass
+    
+    def add_peer_valuation_statistics(self, df, group_column = "Sector", date_column = "asOfDate"):
+        """Add the mean, median, percentile rank and z-score of every valuation ratio among the companies with the same
+        group_column and date_column, plus the ratio vs the peer mean in percent. Rows without a group get NaN."""
+        ratios = df.reindex(columns = list(self.valuation_ratios)).apply(pd.to_numeric, errors = 'coerce')
+        grouped = ratios.groupby([df[group_column], df[date_column]])
+        mean = grouped.transform("mean")
+        median = grouped.transform("median")
+        std = grouped.transform("std")
+        rank = grouped.rank(pct = True)
+        
+        statistics = {}
+        for column, name in self.valuation_ratios.items():
+            statistics[f"Mean{group_column}{name}"] = mean[column]
+            statistics[f"Median{group_column}{name}"] = median[column]
+            statistics[f"{name}{group_column}PercentileRank"] = rank[column]
+            statistics[f"{name}{group_column}ZScore"] = (ratios[column] - mean[column]) / std[column]
+            statistics[f"{name}Vs{group_column}MeanInPercent"] = (ratios[column] / mean[column] - 1) * 100
+        return df.assign(**statistics)
+    
+class DataFactory:
+    def get_formatter(self, format):
+        if format == 'Cleaning':
+            return DataCleaning()
+        elif format == 'Features':
+            return FeatureEngineering()
+        else:
+            ValueError(format)
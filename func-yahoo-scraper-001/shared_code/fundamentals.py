@@ -0,0 +1,251 @@
+import logging
+import os
+import pickle
+import random
+import re
+import tempfile
+import time
+import pandas as pd
+
+from shared_code.ratelimit import RetryPolicy, ThrottledCurlSession
+
+SUMMARY_MODULES = ["assetProfile", "financialData"]
+
+def select_frame(response, symbol):
+    # yahooquery returns a symbol-indexed frame on success and raw dicts or a message on errors
+    if not isinstance(response, pd.DataFrame) or symbol not in response.index:
+        return None
+    return response.loc[response.index == symbol]
+
+def select_summary(response, symbol):
+    summary = response.get(symbol) if isinstance(response, dict) else None
+    if not isinstance(summary, dict) or not all(isinstance(summary.get(module), dict) for module in SUMMARY_MODULES):
+        return None
+    return summary
+
+# One timeseries request per statement, one for valuation measures and one quoteSummary request. The statements
+# aren't combined into one request, all their types in one type= parameter make a URL of about 12 KB.
+REQUESTS = {
+    "income_statement": (lambda ticker: ticker.income_statement(frequency = 'q', trailing = False), select_frame),
+    "balance_sheet": (lambda ticker: ticker.balance_sheet(frequency = 'q', trailing = False), select_frame),
+    "cash_flow": (lambda ticker: ticker.cash_flow(frequency = 'q', trailing = False), select_frame),
+    "valuation_measures": (lambda ticker: ticker.valuation_measures, select_frame),
+    "quote_summary": (lambda ticker: ticker.get_modules(SUMMARY_MODULES), select_summary),
+}
+
+def create_session(retry_policy, asynchronous = False, max_workers = 8):
+    """yahooquery session that rate limits and retries each HTTP request, like yahooquery's own but throttled."""
+    from requests_futures.sessions import FuturesSession
+    from yahooquery.constants import BROWSERS
+    from yahooquery.session_management import setup_session
+    impersonate = random.choice(list(BROWSERS.keys()))
+    session = ThrottledCurlSession(retry_policy, headers = BROWSERS[impersonate], impersonate = impersonate)
+    if asynchronous:
+        session = FuturesSession(max_workers = max_workers, session = session)
+    return setup_session(session)
+
+class ResponseCache:
+    """On-disk TTL cache of raw yahooquery responses keyed by ticker and module."""
+    def __init__(self, directory = None, ttl = None):
+        self.directory = directory or os.getenv("FUNDAMENTALS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "yahoo_fundamentals"))
+        # Shorter than the 3 hour enqueue cadence, so only retries within a run reuse responses, never the next run
+        self.ttl = float(ttl if ttl is not None else os.getenv("FUNDAMENTALS_CACHE_TTL", 3600))
+
+    def get_path(self, symbol, module):
+        return os.path.join(self.directory, f"{re.sub(r'[^A-Za-z0-9._-]', '_', symbol)}.{module}.pkl")
+
+    def get(self, symbol, module):
+        if self.ttl <= 0:
+            return None
+        path = self.get_path(symbol, module)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "rb") as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f'Ignoring unreadable cache entry {path}: {str(e)}')
+            return None
+
+    def set(self, symbol, module, value):
+        if self.ttl <= 0:
+            return
+        path = self.get_path(symbol, module)
+        try:
+            os.makedirs(self.directory, exist_ok = True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as file:
+                pickle.dump(value, file)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f'Could not write cache entry {path}: {str(e)}')
+
+class StockFundamentals:
+    def __init__(self, symbol, retry_policy = None, ticker = None, cache = None):
+        self.symbol = symbol
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.ticker = ticker
+        self.cache = cache or ResponseCache()
+        self.income_statement = None
+        self.balance_sheet = None
+        self.cash_flow = None
+        self.valuation_measure = None
+        self.asset_profile = None
+        self.financial_data = None
+
+    def get_ticker(self):
+        # Created on first use, a fully cached symbol never opens a Yahoo session
+        if self.ticker is None:
+            from yahooquery import Ticker
+            self.ticker = Ticker(self.symbol, session = create_session(self.retry_policy))
+        return self.ticker
+
+    def fetch_cached(self, module):
+        """Return the cached response for module, otherwise fetch it and cache it if it is valid."""
+        value = self.cache.get(self.symbol, module)
+        if value is None:
+            request, select = REQUESTS[module]
+            value = select(request(self.get_ticker()), self.symbol)
+            if value is None:
+                raise ValueError(f"No {module} data returned for {self.symbol}")
+            self.cache.set(self.symbol, module, value)
+        return value
+
+    def fetch_data(self):
+        self.set_data(*[self.fetch_cached(module) for module in REQUESTS])
+
+    def set_data(self, income_statement, balance_sheet, cash_flow, valuation_measure, summary):
+        """Shape the raw yahooquery responses for this symbol into the frames used downstream."""
+        self.income_statement = income_statement.sort_values('asOfDate').set_index("asOfDate")
+        self.income_statement["Ticker"] = self.symbol
+        
+        self.balance_sheet = balance_sheet.sort_values('asOfDate').set_index("asOfDate")
+        self.balance_sheet["Ticker"] = self.symbol
+        
+        self.cash_flow = cash_flow.sort_values('asOfDate').set_index("asOfDate")
+        self.cash_flow["Ticker"] = self.symbol
+        
+        self.valuation_measure = valuation_measure[~valuation_measure.EnterpriseValue.isnull()]
+        
+        self.asset_profile = pd.DataFrame({self.symbol: summary["assetProfile"]}).T
+        self.asset_profile = self.asset_profile.drop(columns = ["companyOfficers"])
+        
+        self.financial_data = pd.DataFrame({self.symbol: summary["financialData"]}).T
+
+class StockFundamentalsBatch:
+    """Fetches fundamentals for many symbols with one multi-symbol Ticker and splits the
+    results per symbol. Symbols whose data is missing or errored are left for a per-symbol fetch."""
+    def __init__(self, symbols, retry_policy = None, cache = None):
+        self.symbols = list(symbols)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.cache = cache or ResponseCache()
+        self.ticker = None
+        self.data = {symbol: {} for symbol in self.symbols}
+
+    def fetch_data(self):
+        for symbol in self.symbols:
+            for module in REQUESTS:
+                value = self.cache.get(symbol, module)
+                if value is not None:
+                    self.data[symbol][module] = value
+
+        missing = [symbol for symbol in self.symbols if len(self.data[symbol]) < len(REQUESTS)]
+        if not missing:
+            return
+        try:
+            from yahooquery import Ticker
+            self.ticker = Ticker(missing, session = create_session(self.retry_policy, asynchronous = True))
+        except Exception as e:
+            logging.error(f'Error creating Ticker for {len(missing)} symbols: {str(e)}')
+            return
+
+        for module, (request, select) in REQUESTS.items():
+            symbols = [symbol for symbol in missing if module not in self.data[symbol]]
+            if not symbols:
+                continue
+            try:
+                response = request(self.ticker)
+            except Exception as e:
+                logging.error(f'Error fetching {module} for {len(symbols)} symbols: {str(e)}')
+                continue
+            for symbol in symbols:
+                value = select(response, symbol)
+                if value is not None:
+                    self.data[symbol][module] = value
+                    self.cache.set(symbol, module, value)
+
+    def get_stock(self, symbol):
+        """Return a populated StockFundamentals for symbol, or None when the batch lacks its data."""
+        data = self.data.get(symbol, {})
+        if len(data) < len(REQUESTS):
+            return None
+
+        stock = StockFundamentals(symbol, self.retry_policy, cache = self.cache)
+        try:
+            stock.set_data(*[data[module] for module in REQUESTS])
+        except Exception as e:
+            logging.error(f'Error splitting batched fundamentals for {symbol}: {str(e)}')
+            return None
+        return stock
+
+PIOTROSKI_COLUMNS = {
+    "income_statement": ["NetIncome", "TotalRevenue", "CostOfRevenue"],
+    "balance_sheet": ["TotalAssets", "LongTermDebt", "CurrentAssets", "CurrentLiabilities", "CommonStock"],
+    "cash_flow": ["OperatingCashFlow"],
+}
+PIOTROSKI_SCORES = ['ROA', 'CFO', 'Delta ROA', 'Quality of Earnings', 'Delta Leverage', 'Delta Liquidity', 'New Equity',
+                    'Gross Margin', 'Asset Turnover']
+
+def get_piotroski_columns(frame, columns):
+    # Missing statement lines become NaN columns, which never pass a signal and score 0
+    frame = frame.reset_index()
+    if "Ticker" not in frame.columns:
+        frame["Ticker"] = ""
+    return frame.reindex(columns = ["Ticker", "asOfDate"] + columns).drop_duplicates(["Ticker", "asOfDate"], keep = "last")
+
+def calculate_piotroski_scores(income_statement, balance_sheet, cash_flow):
+    """Score every balance sheet date against the previous one for one or many tickers.
+    Statements are indexed by asOfDate with a Ticker column, stacked statements are scored per Ticker."""
+    df = get_piotroski_columns(balance_sheet, PIOTROSKI_COLUMNS["balance_sheet"])
+    df = df.merge(get_piotroski_columns(income_statement, PIOTROSKI_COLUMNS["income_statement"]), on = ["Ticker", "asOfDate"], how = "left")
+    df = df.merge(get_piotroski_columns(cash_flow, PIOTROSKI_COLUMNS["cash_flow"]), on = ["Ticker", "asOfDate"], how = "left")
+    df = df.sort_values(["Ticker", "asOfDate"], kind = "stable").reset_index(drop = True)
+
+    df["ReturnOnAssets"] = df.NetIncome / df.TotalAssets
+    df["Leverage"] = df.LongTermDebt / df.TotalAssets
+    df["Liquidity"] = df.CurrentAssets / df.CurrentLiabilities
+    df["GrossMargin"] = (df.TotalRevenue - df.CostOfRevenue) / df.TotalRevenue
+    df["AssetTurnover"] = df.TotalRevenue / df.TotalAssets
+
+    grouped = df.groupby("Ticker", sort = False)
+    prev = grouped[["ReturnOnAssets", "Leverage", "Liquidity", "GrossMargin", "AssetTurnover", "CommonStock"]].shift(1)
+
+    scores = pd.DataFrame({
+        'Date': df.asOfDate,
+        'ROA': df.ReturnOnAssets > 0,
+        'CFO': df.OperatingCashFlow > 0,
+        'Delta ROA': (df.ReturnOnAssets - prev.ReturnOnAssets) > 0,
+        'Quality of Earnings': df.OperatingCashFlow > df.NetIncome,
+        'Delta Leverage': (df.Leverage - prev.Leverage) < 0,
+        'Delta Liquidity': (df.Liquidity - prev.Liquidity) > 0,
+        'New Equity': (df.CommonStock - prev.CommonStock) <= 0,
+        'Gross Margin': df.GrossMargin > prev.GrossMargin,
+        'Asset Turnover': df.AssetTurnover > prev.AssetTurnover,
+    })
+    scores[PIOTROSKI_SCORES] = scores[PIOTROSKI_SCORES].astype(int)
+    scores['Piotroski Score'] = scores[PIOTROSKI_SCORES].sum(axis = 1)
+    scores['Ticker'] = df.Ticker
+
+    # The first date of every ticker has nothing to compare against
+    return scores[grouped.cumcount() > 0].reset_index(drop = True)
+
+class PiotroskiScoreCalculator:
+    def __init__(self, stock):
+        self.stock = stock
+
+    def calculate_score(self):
+        if self.stock.income_statement is None:
+            self.stock.fetch_data()
+        return calculate_piotroski_scores(self.stock.income_statement, self.stock.balance_sheet, self.stock.cash_flow)
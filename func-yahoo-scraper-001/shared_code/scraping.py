@@ -0,0 +1,51 @@
+import logging
+import pandas as pd
+
+from io import StringIO
+from shared_code.ratelimit import RetryPolicy, ThrottledSession
+
+class yahooUtils:
+    def __init__(self):
+        self.nasdaq_base_url = "http://www.nasdaqomxnordic.com" 
+        self.nasdaq_full_url = self.nasdaq_base_url + "/shares/listed-companies/stockholm"
+        self.sp500_url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+        self.headers = {"User-Agent": "Mozilla/5.0 (X11; CrOS x86_64 12871.102.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.141 Safari/537.36"}
+        self.session = ThrottledSession()
+        self.retry_policy = RetryPolicy()
+
+    def scrape_nasdaq_companies(self):
+        from lxml import html
+        
+        page = self.session.get(self.nasdaq_full_url, headers = self.headers)
+        page.raise_for_status()
+        tree = html.fromstring(page.content)
+        page.close
+        tree.make_links_absolute(self.nasdaq_base_url)
+        trs = tree.xpath('//tbody//tr')
+        df_companies = pd.DataFrame(
+                [[j.text_content() for j in i.getchildren()[:-1]] for i in trs],
+                columns = ['name','symbol','currency','isin','sector','icb']
+                )
+        # here we create the ticker names for the queries to Yahoo Finance
+        df_companies['tickers'] = ["-".join(i.split(" "))+".ST" for i in df_companies['symbol'].values]
+        return df_companies
+
+    def scrape_sp500_comapnies(self):
+        page = self.session.get(self.sp500_url, headers = self.headers)
+        page.raise_for_status()
+        data = pd.read_html(StringIO(page.text))
+        return data[0]
+
+    def get_ticker_financials(self, ticker):
+        import yfinance as yf
+        
+        try:
+            ticker_object = yf.Ticker(ticker)
+            info = self.retry_policy.call("finance.yahoo.com", lambda: ticker_object.info)
+            temp = pd.DataFrame.from_dict(info, orient = "index")
+            temp.reset_index(inplace = True)
+            temp.columns = ["Attribute", "Recent"]
+            temp["Ticker"] = ticker
+            return temp
+        except Exception as e:
+            print(e)
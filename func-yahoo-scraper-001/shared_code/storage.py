@@ -0,0 +1,960 @@
+import asyncio
+import io
+import json
+import os
+import logging
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient
+from azure.identity import DefaultAzureCredential
+from azure.keyvault.secrets import SecretClient
+
+class ByteBudget:
+    """Bounds the number of bytes that are downloaded and decoded at the same time."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        # A blob larger than the whole budget is let through on its own
+        size = min(size, self.max_bytes)
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight == 0 or self.in_flight + size <= self.max_bytes)
+            self.in_flight += size
+        return size
+
+    def try_acquire(self, size):
+        """Like acquire, but returns None instead of waiting when size doesn't fit."""
+        size = min(size, self.max_bytes)
+        with self.condition:
+            if self.in_flight > 0 and self.in_flight + size > self.max_bytes:
+                return None
+            self.in_flight += size
+        return size
+
+    def release(self, size):
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+class BlobRangeFile(io.RawIOBase):
+    """Read-only, seekable file over a blob that fetches only the requested byte ranges.
+
+    Lets pyarrow read the parquet footer and just the needed column chunks/row groups.
+    """
+    def __init__(self, blob_client, size):
+        self.blob_client = blob_client
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        data = self.blob_client.download_blob(offset = self.position, length = length).readall()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class MemoryViewWriter:
+    """Minimal writable stream that fills a slice of a preallocated buffer in place."""
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def write(self, data):
+        length = len(data)
+        self.view[self.position:self.position + length] = data
+        self.position += length
+        return length
+
+
+class ClientRegistry:
+    """Process-wide cache of credentials, Key Vault secrets and service clients, kept across warm invocations."""
+    lock = threading.RLock()
+    clients = {}
+    secrets = {}
+    secret_ttl = int(os.getenv("KEY_VAULT_SECRET_TTL", 3600))
+
+    @classmethod
+    def get_or_create(cls, key, factory):
+        with cls.lock:
+            if key not in cls.clients:
+                cls.clients[key] = factory()
+            return cls.clients[key]
+
+    @classmethod
+    def get_credential(cls):
+        return cls.get_or_create("credential", lambda: DefaultAzureCredential(additionally_allowed_tenants=['*']))
+
+    @classmethod
+    def get_secret(cls, secret_client, secret_name):
+        key = (secret_client.vault_url, secret_name)
+        with cls.lock:
+            cached = cls.secrets.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        
+        secret = secret_client.get_secret(secret_name)
+        with cls.lock:
+            cls.secrets[key] = (time.monotonic() + cls.secret_ttl, secret)
+        return secret
+
+
+def normalize_key_types(table):
+    """Cast key columns to one type per kind of key, so keys written by different runs (timestamp[us] or [ns], dates,
+    int32 or int64, dictionary encoded or plain strings) compare equal."""
+    fields = []
+    for field in table.schema:
+        field_type = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        if pa.types.is_timestamp(field_type):
+            field_type = pa.timestamp("ns", field_type.tz)
+        elif pa.types.is_date(field_type):
+            field_type = pa.timestamp("ns")
+        elif pa.types.is_integer(field_type):
+            field_type = pa.int64()
+        elif pa.types.is_floating(field_type):
+            field_type = pa.float64()
+        elif pa.types.is_large_string(field_type):
+            field_type = pa.string()
+        fields.append(pa.field(field.name, field_type))
+    return table.cast(pa.schema(fields))
+
+
+class KeyDeduplicator:
+    """Keeps only the first row seen per key across a stream of record batches (or tables)."""
+    def __init__(self, keys = None):
+        self.keys = keys
+        self.seen_keys = set()
+
+    def filter(self, batch):
+        if self.keys is None or batch.num_rows == 0:
+            return batch
+        key_table = normalize_key_types(pa.table({key: batch.column(key) for key in self.keys}))
+        key_table = key_table.append_column("row", pa.array(range(batch.num_rows), type = pa.int64()))
+
+        # First row per key within the batch, then drop the keys of earlier batches. Those are kept in a hashed set,
+        # so a batch costs a lookup per distinct key instead of a pass over every key seen so far.
+        first_rows = key_table.group_by(self.keys, use_threads = False).aggregate([("row", "min")])
+        batch_keys = list(zip(*[first_rows.column(key).to_pylist() for key in self.keys]))
+        is_new = [key not in self.seen_keys for key in batch_keys]
+        self.seen_keys.update(batch_keys)
+        rows = first_rows.column("row_min").filter(pa.array(is_new, type = pa.bool_()))
+        return batch.take(rows.combine_chunks().sort())
+
+
+class DataFrameSink:
+    """Collects record batches as zstd compressed in-memory parquet files (one per distinct schema, bronze files from
+    different runs don't always share one), so only compressed data is held until the final conversion."""
+    def __init__(self):
+        self.sinks = {}
+
+    def write_batch(self, batch):
+        schema_key = batch.schema.to_string()
+        if schema_key not in self.sinks:
+            sink = pa.BufferOutputStream()
+            self.sinks[schema_key] = (sink, pq.ParquetWriter(sink, batch.schema, compression = "zstd"))
+        self.sinks[schema_key][1].write_batch(batch)
+
+    def to_pandas(self):
+        if not self.sinks:
+            return pd.DataFrame()
+        tables = []
+        for sink, writer in self.sinks.values():
+            writer.close()
+            tables.append(pq.read_table(pa.BufferReader(sink.getvalue())))
+        self.sinks.clear()
+        table = pa.concat_tables(tables, promote_options = "permissive")
+        tables.clear()
+        return table.to_pandas(split_blocks = True, self_destruct = True)
+
+
+COMPACTED_PREFIX = "compacted_"
+COMPACTION_SORT_COLUMNS = ["Ticker", "symbol", "index", "asOfDate"]
+
+
+def is_compacted(blob_name):
+    return blob_name.rsplit("/", 1)[-1].startswith(COMPACTED_PREFIX)
+
+
+def is_date(value):
+    try:
+        date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+def prefer_compacted(blob_list):
+    """Skip the small blobs of directories that already have compacted files."""
+    blob_list = list(blob_list)
+    compacted_directories = {blob.name.rsplit("/", 1)[0] for blob in blob_list if is_compacted(blob.name)}
+    return [blob for blob in blob_list if is_compacted(blob.name) or blob.name.rsplit("/", 1)[0] not in compacted_directories]
+
+
+def get_existing_columns(source, columns):
+    """Drop requested columns a parquet file doesn't have, bronze files from different runs don't always share a schema."""
+    if columns is None:
+        return None
+    names = pq.read_schema(source).names
+    return [column for column in columns if column in names]
+
+
+class AzureUtils:
+    def __init__(self, vault_url=None, storageaccount=None, max_workers = None, max_in_flight_bytes = None):
+        self.vault_url = "https://kv-yahoo-prod-001.vault.azure.net/"
+        # Clients are per instance so concurrent invocations in one worker don't overwrite each other's,
+        # the underlying SDK clients come from ClientRegistry and are safe to share between threads
+        self.blob_service_client = None
+        self.datalake_service_client = None
+        self.queue_client = None
+        self.max_workers = max_workers or int(os.getenv("BLOB_DOWNLOAD_WORKERS", 16))
+        self.max_in_flight_bytes = max_in_flight_bytes or int(os.getenv("BLOB_DOWNLOAD_MAX_BYTES", 256 * 1024 * 1024))
+        # Below this size one full download is cheaper than several ranged reads
+        self.ranged_read_min_bytes = int(os.getenv("BLOB_RANGED_READ_MIN_BYTES", 4 * 1024 * 1024))
+        self.download_chunk_bytes = int(os.getenv("BLOB_DOWNLOAD_CHUNK_BYTES", 8 * 1024 * 1024))
+        self.compaction_max_rows = int(os.getenv("BRONZE_COMPACTION_MAX_ROWS", 1000000))
+        self.compaction_row_group_size = int(os.getenv("BRONZE_COMPACTION_ROW_GROUP_SIZE", 65536))
+
+    def initialize_storage_account_ad(self, storage_account_secret, blob):
+        try:  
+            account_url = "{}://{}.blob.core.windows.net".format("https", blob)
+            self.blob_service_client = ClientRegistry.get_or_create(
+                ("blob", account_url, storage_account_secret),
+                lambda: BlobServiceClient(account_url = account_url, credential = storage_account_secret)
+                )
+        except Exception as e:
+            logging.error(f"Could not create blob service client: {e}")
+            
+    def initialize_data_lake(self, storage_account_name, storage_account_secret):
+        try:  
+            from azure.storage.filedatalake import DataLakeServiceClient
+            
+            account_url = "{}://{}.dfs.core.windows.net".format("https", storage_account_name)
+            self.datalake_service_client = ClientRegistry.get_or_create(
+                ("datalake", account_url, storage_account_secret),
+                lambda: DataLakeServiceClient(account_url = account_url, credential = storage_account_secret)
+                )
+        except Exception as e:
+            logging.error(f"Could not create data lake service client: {e}")
+
+    def initialize_queue_client(self, accountUrl, queueName):
+        from azure.storage.queue import QueueClient, BinaryBase64EncodePolicy, BinaryBase64DecodePolicy
+        
+        try:  
+            self.queue_client = ClientRegistry.get_or_create(
+                ("queue", accountUrl, queueName),
+                lambda: QueueClient.from_connection_string(
+                    conn_str = accountUrl, 
+                    queue_name = queueName,
+                    message_encode_policy = BinaryBase64EncodePolicy(),
+                    message_decode_policy = BinaryBase64DecodePolicy()
+                    )
+                )
+            logging.info(f"Connected to queue {queueName} successfully")
+        except Exception as e:
+            logging.error(f"Error connecting to queue {queueName}: {e}")
+
+    def send_queue_message(self, message):
+        try:
+            self.queue_client.send_message(message.encode("utf-8"))
+            logging.info(f"Queued message {message} successfully")
+        except Exception as e:
+            logging.error(f"Error queueing message {message}: {e}")
+
+    def send_queue_messages(self, messages):
+        """Send messages concurrently instead of one blocking request after another."""
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            list(executor.map(self.send_queue_message, messages))
+
+    def send_ticker_batches(self, tickers, batch_size = None):
+        """Pack tickers into json list messages of batch_size (TICKER_BATCH_SIZE, default 20) tickers each."""
+        batch_size = batch_size or int(os.getenv("TICKER_BATCH_SIZE", 20))
+        tickers = list(tickers)
+        messages = [json.dumps(tickers[i:i + batch_size]) for i in range(0, len(tickers), batch_size)]
+        self.send_queue_messages(messages)
+        logging.info(f"Queued {len(tickers)} tickers in {len(messages)} messages")
+
+    def get_tickers_from_message(self, body):
+        """Tickers in a queue message, either a json list of tickers or a single plain ticker."""
+        if body.startswith("["):
+            return json.loads(body)
+        return [body]
+   
+    def upload_blob(self, data, container, blob_name, max_concurrency = 1):
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        try:
+            blob_client_instance.upload_blob(data, overwrite = True, encoding = "utf-8", length=len(data), max_concurrency = max_concurrency)
+            logging.info(f"Created blob {blob_name} successfully")
+            return True
+        except Exception as e:
+            logging.error(f"Error creating blob {blob_name}: {e}")
+            return False
+    
+    def delete_blob(self, container, blob_name):
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        try:
+            blob_client_instance.delete_blob()
+            logging.info(f"Deleted blob {blob_name} successfully")
+            return True
+        except Exception as e:
+            logging.error(f"Error deleting blob {blob_name}: {e}")
+            return False
+            
+    def write_dataframe_to_datalake(self, df, dir_name, filename):
+        file_system_client = self.datalake_service_client.get_file_system_client(file_system = "gold")
+        directory_client = file_system_client.get_directory_client(dir_name)
+        file_client = directory_client.create_file(f'{filename}_{date.today()}.Parquet')
+        
+        df_parquet = df.to_parquet()
+        file_client.append_data(data = df_parquet, offset = 0, length = len(df_parquet))
+        file_client.flush_data(len(df_parquet))
+        return True
+    
+    def download_blob_buffer(self, container, blob_name, size = None):
+        """Download a blob in parallel ranges straight into one preallocated buffer, returned as a pyarrow Buffer (no copy)."""
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        if size is None:
+            size = blob_client_instance.get_blob_properties().size
+        data = bytearray(size)
+        view = memoryview(data)
+        chunk_size = self.download_chunk_bytes
+
+        def download_range(offset):
+            length = min(chunk_size, size - offset)
+            blob_client_instance.download_blob(offset = offset, length = length).readinto(MemoryViewWriter(view[offset:offset + length]))
+
+        offsets = range(0, size, chunk_size)
+        if len(offsets) > 1:
+            with ThreadPoolExecutor(max_workers = min(self.max_workers, len(offsets))) as executor:
+                list(executor.map(download_range, offsets))
+        elif size > 0:
+            download_range(0)
+        return pa.py_buffer(data)
+
+    def open_parquet_source(self, container, blob_name, size = None, projected = False):
+        """Projected reads of large blobs use ranged reads, everything else is downloaded into one buffer."""
+        if projected:
+            blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+            if size is None:
+                size = blob_client_instance.get_blob_properties().size
+            if size >= self.ranged_read_min_bytes:
+                return BlobRangeFile(blob_client_instance, size)
+        return pa.BufferReader(self.download_blob_buffer(container, blob_name, size))
+
+    def download_parquet_blob(self, container, blob_name, columns = None, filters = None):
+        """Download a parquet blob as a DataFrame.
+
+        With columns and/or filters only the needed columns and row groups are read (filters use the pyarrow DNF format).
+        """
+        try:
+            df = self.download_parquet_table(container, blob_name, columns, filters).to_pandas()
+            logging.info(f"Downloaded blob {blob_name} successfully")    
+        except Exception as e:
+            logging.error(f"Error downloadning blob {blob_name}: {e}")
+            raise
+        return df
+    
+    def download_parquet_table(self, container, blob_name, columns = None, filters = None, size = None):
+        """Download a parquet blob as a pyarrow Table, convert with to_pandas() only when a DataFrame is needed."""
+        source = self.open_parquet_source(container, blob_name, size, projected = columns is not None or filters is not None)
+        return pq.read_table(source, columns = get_existing_columns(source, columns), filters = filters, pre_buffer = True)
+
+    def download_csv_blob(self, container, blob_name):
+        try:
+            df = pd.read_csv(pa.BufferReader(self.download_blob_buffer(container, blob_name)))
+            logging.info(f"Downloaded blob {blob_name} successfully")    
+        except Exception as e:
+            logging.error(f"Error downloadning blob {blob_name}: {e}")
+            raise
+        return df
+    
+    def download_blobs(self, container, blob_list, download_function):
+        """Download and decode blobs on a thread pool, keeping at most max_in_flight_bytes in flight. Results keep the order of blob_list."""
+        budget = ByteBudget(self.max_in_flight_bytes)
+
+        def download(blob):
+            size = budget.acquire(blob.size or 0)
+            try:
+                return download_function(container, blob.name)
+            finally:
+                budget.release(size)
+
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            return list(executor.map(download, blob_list))
+
+    def iter_blobs(self, container, blob_list, download_function):
+        """Like download_blobs, but yields results in order with at most max_workers downloads and max_in_flight_bytes
+        ahead of the consumer. A blob's bytes are released once the consumer asks for the next result."""
+        budget = ByteBudget(self.max_in_flight_bytes)
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            pending = deque()
+            for blob in blob_list:
+                # Hand results to the consumer until the blob fits, waiting here would block the consumer itself
+                size = budget.try_acquire(blob.size or 0)
+                while size is None:
+                    future, pending_size = pending.popleft()
+                    yield future.result()
+                    budget.release(pending_size)
+                    size = budget.try_acquire(blob.size or 0)
+                pending.append((executor.submit(download_function, container, blob.name), size))
+                if len(pending) >= self.max_workers:
+                    future, pending_size = pending.popleft()
+                    yield future.result()
+                    budget.release(pending_size)
+            while pending:
+                future, pending_size = pending.popleft()
+                yield future.result()
+                budget.release(pending_size)
+
+    def iter_table_batches(self, container, directory, columns = None, keys = None, filters = None, blob_list = None):
+        """Yield record batches of every parquet blob under directory (or of blob_list), newest blobs first.
+
+        With keys, only the first row seen per key is yielded, i.e. the row from the newest blob.
+        """
+        if blob_list is None:
+            blob_list = self.list_blobs(container, directory)
+        blob_list = sorted(prefer_compacted(blob_list), key = lambda blob: blob.name, reverse = True)
+        deduplicator = KeyDeduplicator(keys)
+        
+        sizes = {blob.name: blob.size for blob in blob_list}
+        download = lambda container, blob_name: self.download_parquet_table(container, blob_name, columns, filters, sizes[blob_name])
+        
+        for table in self.iter_blobs(container, blob_list, download):
+            # Drop the pandas metadata so tables with different columns can be concatenated
+            table = table.replace_schema_metadata(None)
+            for batch in table.to_batches():
+                batch = deduplicator.filter(batch)
+                if batch.num_rows > 0:
+                    yield batch
+
+    def ingest_table(self, container, directory, columns = None, keys = None, filters = None, blob_list = None):
+        """Read iter_table_batches into one DataFrame.
+
+        Batches go through a DataFrameSink as they arrive, so only compressed data is held until the final conversion
+        instead of every decoded batch.
+        """
+        sink = DataFrameSink()
+        for batch in self.iter_table_batches(container, directory, columns, keys, filters, blob_list):
+            sink.write_batch(batch)
+        return sink.to_pandas()
+
+    def ingest_bronze_data(self, directory, columns = None, keys = None, filters = None, blob_list = None):
+        return self.ingest_table("bronze", directory, columns, keys, filters, blob_list)
+    
+    def ingest_silver_data(self, directory, columns = None, keys = None, filters = None):
+        return self.ingest_table("silver", directory, columns, keys, filters)
+    
+    def list_new_blobs(self, container, directory, watermark = None):
+        """List the blobs under directory that are new or changed since watermark.
+
+        Returns the blobs and the watermark to save once they are processed. Date folders ({...}/yyyy-mm-dd/) older
+        than the newest date folder in the watermark aren't listed at all, other blobs are compared by ETag.
+        """
+        watermark = watermark or {}
+        dates = dict(watermark.get("dates", {}))
+        etags = watermark.get("etags", {})
+        container_client_instance = self.blob_service_client.get_container_client(container)
+
+        blobs = []
+        prefixes = [directory]
+        while prefixes:
+            prefix = prefixes.pop()
+            date_prefixes = []
+            for item in container_client_instance.walk_blobs(name_starts_with = prefix, delimiter = "/"):
+                if not item.name.endswith("/"):
+                    blobs.append(item)
+                elif is_date(item.name[len(prefix):-1]):
+                    date_prefixes.append(item.name)
+                else:
+                    prefixes.append(item.name)
+
+            newest = dates.get(prefix)
+            for date_prefix in date_prefixes:
+                day = date_prefix[len(prefix):-1]
+                if newest is None or day >= newest:
+                    blobs.extend(container_client_instance.list_blobs(name_starts_with = date_prefix))
+            if date_prefixes:
+                dates[prefix] = max([date_prefix[len(prefix):-1] for date_prefix in date_prefixes] + ([newest] if newest else []))
+
+        new_blobs = [blob for blob in blobs if etags.get(blob.name) != blob.etag]
+        logging.info(f"Found {len(new_blobs)} new or changed blobs of {len(blobs)} listed under {container}/{directory}")
+        return new_blobs, {"dates": dates, "etags": {blob.name: blob.etag for blob in blobs}}
+
+    def read_fact(self, table, columns = None, container = "gold"):
+        """Read every part of a fact table, see upsert_fact."""
+        return self.ingest_table(container, table, columns)
+
+    def get_key_sidecar_name(self, table):
+        directory, name = table.rsplit("/", 1)
+        return f"{directory}/_keys/{name}.parquet"
+
+    def load_fact_keys(self, table, keys, container = "gold"):
+        """Return the keys of a fact table, the names of its parts and whether the key sidecar is missing any of them.
+
+        Keys come from the sorted key sidecar next to the table, so the fact data isn't read. Only parts the sidecar
+        doesn't list yet (a failed sidecar write, or a table that never had one) have their key columns read.
+        """
+        parts = [blob for blob in self.list_blobs(container, table) if blob.name.endswith(".parquet")]
+        tables = []
+        covered = set()
+        try:
+            sidecar = self.download_parquet_table(container, self.get_key_sidecar_name(table))
+            covered = set(json.loads(sidecar.schema.metadata[b"parts"]))
+            tables.append(normalize_key_types(sidecar.replace_schema_metadata(None)))
+        except ResourceNotFoundError:
+            logging.info(f"Fact table {container}/{table} has no key sidecar yet")
+
+        uncovered = [blob for blob in parts if blob.name not in covered]
+        if uncovered:
+            sizes = {blob.name: blob.size for blob in uncovered}
+            download = lambda container, blob_name: self.download_parquet_table(container, blob_name, keys, size = sizes[blob_name]).replace_schema_metadata(None)
+            for part_keys in self.download_blobs(container, uncovered, download):
+                missing = [key for key in keys if key not in part_keys.column_names]
+                if missing:
+                    raise ValueError(f"Fact table {container}/{table} has no key column(s) {missing}")
+                tables.append(normalize_key_types(part_keys.select(keys)))
+
+        part_names = sorted(covered | {blob.name for blob in parts})
+        if not tables:
+            return None, part_names, False
+        try:
+            keys_table = pa.concat_tables([keys_table.select(keys) for keys_table in tables])
+        except pa.ArrowInvalid as e:
+            raise ValueError(f"Key types of the parts of fact table {container}/{table} don't match: {e}")
+        return keys_table, part_names, len(uncovered) > 0
+
+    def get_fact_keys(self, table, keys, container = "gold"):
+        return self.load_fact_keys(table, keys, container)[0]
+
+    def write_key_sidecar(self, table, keys_table, part_names, container = "gold"):
+        """Store the sorted keys of a fact table with the list of parts they cover, returns whether the upload succeeded.
+
+        A failed write only costs a slower next run of upsert_fact.
+        """
+        keys_table = normalize_key_types(keys_table)
+        keys_table = keys_table.sort_by([(key, "ascending") for key in keys_table.column_names])
+        keys_table = keys_table.replace_schema_metadata({"parts": json.dumps(part_names)})
+        sink = pa.BufferOutputStream()
+        pq.write_table(keys_table, sink, compression = "zstd")
+        directory, name = self.get_key_sidecar_name(table).rsplit("/", 1)
+        return self.upload_blob(sink.getvalue().to_pybytes(), f"{container}/{directory}", name)
+
+    def upsert_fact(self, table, keys, new_rows, container = "gold"):
+        """Append the rows of new_rows whose keys aren't in the fact table yet, returns the number of rows appended.
+
+        A fact table is every parquet blob whose name starts with table, e.g. for "factincomestatement/fact_incomeStatement"
+        the fact_incomeStatement.parquet file plus the fact_incomeStatement_{n}.parquet parts written here, so earlier
+        parts are never rewritten. compact_fact merges the parts back into the single file for readers that only read
+        that one. Rows whose keys already exist are kept as they are, like the full-table merges this replaces. New
+        keys are found with a hash join against the table's key sidecar.
+        """
+        if new_rows.empty:
+            logging.info(f"No rows to add to fact table {container}/{table}")
+            return 0
+        new_table = pa.Table.from_pandas(new_rows, preserve_index = False).replace_schema_metadata(None)
+        new_table = KeyDeduplicator(keys).filter(new_table)
+        new_keys = normalize_key_types(new_table.select(keys))
+
+        existing_keys, part_names, sidecar_is_stale = self.load_fact_keys(table, keys, container)
+        if existing_keys is not None and existing_keys.num_rows > 0 and new_table.num_rows > 0:
+            if existing_keys.schema != new_keys.schema:
+                raise ValueError(f"Key types of fact table {container}/{table} ({existing_keys.schema}) don't match the new rows ({new_keys.schema})")
+            # Joined on the normalized keys, the rows themselves are written with their own types
+            new_keys = new_keys.append_column("row", pa.array(range(new_keys.num_rows), type = pa.int64()))
+            rows = existing_keys.join(new_keys, keys = keys, join_type = "right anti").sort_by("row").column("row")
+            new_table = new_table.take(rows)
+            new_keys = new_keys.take(rows).select(keys)
+
+        if new_table.num_rows == 0:
+            logging.info(f"No new rows for fact table {container}/{table}")
+            if sidecar_is_stale:
+                self.write_key_sidecar(table, existing_keys, part_names, container)
+            return 0
+
+        directory, name = table.rsplit("/", 1)
+        part_name = f"{name}_{time.time_ns()}.parquet"
+        sink = pa.BufferOutputStream()
+        pq.write_table(new_table, sink)
+        if not self.upload_blob(sink.getvalue().to_pybytes(), f"{container}/{directory}", part_name, max_concurrency = 4):
+            raise IOError(f"Could not append {new_table.num_rows} rows to fact table {container}/{table}")
+        logging.info(f"Appended {new_table.num_rows} rows to fact table {container}/{table}")
+
+        keys_table = new_keys if existing_keys is None else pa.concat_tables([existing_keys, new_keys])
+        self.write_key_sidecar(table, keys_table, part_names + [f"{directory}/{part_name}"], container)
+        return new_table.num_rows
+
+    def replace_fact_rows(self, table, keys, column, new_rows, container = "gold"):
+        """Replace every row of the fact table whose column value (e.g. asOfDate) is in new_rows with new_rows.
+
+        For rows that are recomputed together, like peer statistics per date, where upsert_fact would keep the stale
+        rows. Only the blobs holding one of the values are rewritten, the new rows are appended as a new part. The
+        values' keys are dropped from the key sidecar first, so a run that fails halfway is repaired by the next run
+        replacing the same values again.
+        """
+        if new_rows.empty:
+            logging.info(f"No rows to replace in fact table {container}/{table}")
+            return 0
+        values = normalize_key_types(pa.Table.from_pandas(new_rows[[column]], preserve_index = False).replace_schema_metadata(None))
+        values = pc.unique(values.column(column).combine_chunks())
+        is_replaced = lambda part: pc.is_in(normalize_key_types(part.select([column])).column(column), value_set = values)
+
+        existing_keys, part_names, _ = self.load_fact_keys(table, keys, container)
+        if existing_keys is not None:
+            if not self.write_key_sidecar(table, existing_keys.filter(pc.invert(is_replaced(existing_keys))), part_names, container):
+                raise IOError(f"Could not update the key sidecar of fact table {container}/{table}")
+
+        parts = [blob for blob in self.list_blobs(container, table) if blob.name.endswith(".parquet")]
+        part_columns = self.download_blobs(container, parts, lambda container, blob_name: self.download_parquet_table(container, blob_name, [column]))
+        for blob, part_column in zip(parts, part_columns):
+            if not pc.any(is_replaced(part_column)).as_py():
+                continue
+            part = self.download_parquet_table(container, blob.name)
+            part = part.filter(pc.invert(is_replaced(part)))
+            sink = pa.BufferOutputStream()
+            pq.write_table(part, sink)
+            directory, name = blob.name.rsplit("/", 1)
+            if not self.upload_blob(sink.getvalue().to_pybytes(), f"{container}/{directory}", name, max_concurrency = 4):
+                raise IOError(f"Could not rewrite {container}/{blob.name}")
+            logging.info(f"Removed {column} rows to replace from {container}/{blob.name}, {part.num_rows} rows left")
+
+        return self.upsert_fact(table, keys, new_rows, container)
+
+    def compact_fact(self, table, keys, container = "gold"):
+        """Merge the parts of a fact table back into its single {name}.parquet file, returns the number of parts merged.
+
+        Readers that only read the single file (the Power BI report) see rows appended by upsert_fact once this has run.
+        Parts are deleted after the merged file is uploaded, a part left behind by a failed delete only holds keys the
+        merged file already has and is merged (and deduplicated) again by the next compaction.
+        """
+        single_name = f"{table}.parquet"
+        blob_list = [blob for blob in self.list_blobs(container, table) if blob.name.endswith(".parquet")]
+        parts = [blob for blob in blob_list if blob.name != single_name]
+        if not parts:
+            logging.info(f"Fact table {container}/{table} has no parts to compact")
+            return 0
+
+        # Oldest blob first (the single file, then parts by write time) so the row that was inserted first is kept.
+        # Key columns are written with their normalized types, so parts whose key types drifted converge here.
+        download = lambda container, blob_name: self.download_parquet_table(container, blob_name).replace_schema_metadata(None)
+        deduplicator = KeyDeduplicator(keys)
+        tables = []
+        for part in self.download_blobs(container, sorted(blob_list, key = lambda blob: blob.name), download):
+            for field in normalize_key_types(part.select(keys)).schema:
+                index = part.schema.get_field_index(field.name)
+                part = part.set_column(index, field, part.column(index).cast(field.type))
+            tables.append(deduplicator.filter(part))
+        merged = pa.concat_tables(tables, promote_options = "permissive")
+        tables.clear()
+        sink = pa.BufferOutputStream()
+        pq.write_table(merged, sink)
+        directory, name = single_name.rsplit("/", 1)
+        if not self.upload_blob(sink.getvalue().to_pybytes(), f"{container}/{directory}", name, max_concurrency = 4):
+            raise IOError(f"Could not upload compacted fact table {container}/{table}")
+
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            list(executor.map(lambda blob: self.delete_blob(container, blob.name), parts))
+        self.write_key_sidecar(table, merged.select(keys), [single_name], container)
+        logging.info(f"Compacted {len(parts)} parts of fact table {container}/{table} into {merged.num_rows} rows")
+        return len(parts)
+
+    def compact_directory(self, container, directory, blob_list):
+        """Merge the small parquet blobs of one directory into a few large files, then delete the originals.
+
+        Rows are sorted by ticker and date so row group statistics let projected reads skip row groups.
+        """
+        blob_list = list(blob_list)
+        # Newest blobs first, so the first row per key stays the newest one like in iter_table_batches
+        blobs = sorted([blob for blob in blob_list if not is_compacted(blob.name)], key = lambda blob: blob.name, reverse = True)
+        if not blobs:
+            return 0
+        download = lambda container, blob_name: self.download_parquet_table(container, blob_name).replace_schema_metadata(None)
+        table = pa.concat_tables(self.download_blobs(container, blobs, download), promote_options = "permissive")
+        sort_keys = [(column, "ascending") for column in COMPACTION_SORT_COLUMNS if column in table.column_names]
+        if sort_keys:
+            table = table.sort_by(sort_keys)
+
+        part = sum(1 for blob in blob_list if is_compacted(blob.name))
+        uploaded = []
+        for offset in range(0, table.num_rows, self.compaction_max_rows):
+            sink = pa.BufferOutputStream()
+            pq.write_table(table.slice(offset, self.compaction_max_rows), sink, row_group_size = self.compaction_row_group_size)
+            blob_name = f"{directory}/{COMPACTED_PREFIX}{part + len(uploaded):05d}.parquet"
+            if not self.upload_blob(sink.getvalue().to_pybytes(), container, blob_name):
+                # A partial set of compacted files would hide the small blobs from readers
+                for uploaded_name in uploaded:
+                    self.delete_blob(container, uploaded_name)
+                raise IOError(f"Could not upload compacted data for {container}/{directory}")
+            uploaded.append(blob_name)
+
+        # Readers ignore the small blobs once a compacted file exists, so a failed delete only leaves garbage behind
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            list(executor.map(lambda blob: self.delete_blob(container, blob.name), blobs))
+        logging.info(f"Compacted {len(blobs)} blobs in {container}/{directory} into {table.num_rows} rows")
+        return len(blobs)
+
+    def compact_daily_directories(self, container, directory, before = None):
+        """Compact every {directory}/.../{date} folder older than before (today by default)."""
+        before = str(before or date.today())
+        directories = {}
+        for blob in self.list_blobs(container, directory):
+            directories.setdefault(blob.name.rsplit("/", 1)[0], []).append(blob)
+
+        compacted = 0
+        for name, blob_list in sorted(directories.items()):
+            day = name.rsplit("/", 1)[-1]
+            if not is_date(day) or day >= before:
+                continue
+            try:
+                compacted += self.compact_directory(container, name, blob_list)
+            except Exception as e:
+                logging.error(f"Error compacting {container}/{name}: {e}")
+        return compacted
+
+    def list_blobs(self, container, blob_name_starts_with):
+        try:
+            container_client_instance = self.blob_service_client.get_container_client(container)
+            blob_list = container_client_instance.list_blobs(blob_name_starts_with)
+            logging.info(f"Retreived list of blobs that starts with name {blob_name_starts_with} from container {container}")
+        except Exception as e:
+            logging.error(f"Error retreiving list of blobs in container {container} with blob name starting with {blob_name_starts_with}: {e}")
+        return blob_list
+            
+    def initialize_key_vault(self):
+        return ClientRegistry.get_or_create(
+            ("secret_client", self.vault_url),
+            lambda: SecretClient(vault_url = self.vault_url, credential = ClientRegistry.get_credential())
+            )
+
+    def get_key_vault_secret(self, secret_client, secret_name):
+        return ClientRegistry.get_secret(secret_client, secret_name)
+
+class WatermarkStore:
+    """Keeps the bronze watermarks of a gold job in a json blob, one per bronze directory, see AzureUtils.list_new_blobs."""
+    def __init__(self, azure_utils, name, container = "gold"):
+        self.azure_utils = azure_utils
+        self.container = container
+        self.blob_name = f"_watermarks/{name}.json"
+
+    def load(self):
+        try:
+            return json.loads(self.azure_utils.download_blob_buffer(self.container, self.blob_name).to_pybytes())
+        except ResourceNotFoundError:
+            return {}
+
+    def save(self, watermarks):
+        return self.azure_utils.upload_blob(json.dumps(watermarks).encode("utf-8"), self.container, self.blob_name)
+
+    def list_new_blobs(self, watermarks, directory, container = "bronze"):
+        """List new blobs under directory and move its watermark in watermarks, which is stored by save()."""
+        blob_list, watermarks[directory] = self.azure_utils.list_new_blobs(container, directory, watermarks.get(directory))
+        return blob_list
+
+
+class BronzeWriter:
+    """Buffers bronze rows per dataset and uploads them as a few larger parquet files.
+
+    A dataset is flushed once it holds max_rows rows, everything is flushed when max_seconds have passed since
+    the last flush and on close() (or when leaving the with block). Files are named by write time so newer files
+    sort after older ones in the same day folder.
+    """
+    def __init__(self, azure_utils, index_name, max_rows = None, max_seconds = None):
+        self.azure_utils = azure_utils
+        self.index_name = index_name
+        self.max_rows = max_rows or int(os.getenv("BRONZE_WRITER_MAX_ROWS", 50000))
+        self.max_seconds = max_seconds or float(os.getenv("BRONZE_WRITER_MAX_SECONDS", 120))
+        self.buffers = {}
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Rows buffered before an error belong to tickers that completed, so they are written either way
+        self.close()
+
+    def write(self, dataset, df):
+        table = pa.Table.from_pandas(df, preserve_index = False).replace_schema_metadata(None)
+        self.buffers.setdefault(dataset, []).append(table)
+        if sum(table.num_rows for table in self.buffers[dataset]) >= self.max_rows:
+            self.flush([dataset])
+        elif time.monotonic() - self.last_flush >= self.max_seconds:
+            self.flush()
+
+    def get_tables(self, dataset):
+        tables = self.buffers.pop(dataset)
+        try:
+            return [pa.concat_tables(tables, promote_options = "permissive")]
+        except pa.ArrowInvalid as e:
+            # Columns whose types can't be unified across tickers, keep one file per ticker instead
+            logging.warning(f"Could not combine {dataset} rows into one file: {e}")
+            return tables
+
+    def upload_dataset(self, dataset):
+        directory = f"bronze/{dataset}/{self.index_name}/{date.today()}"
+        for table in self.get_tables(dataset):
+            sink = pa.BufferOutputStream()
+            pq.write_table(table, sink)
+            blob_name = f"{dataset}_{time.time_ns()}_{os.urandom(4).hex()}.parquet"
+            if not self.azure_utils.upload_blob(sink.getvalue().to_pybytes(), directory, blob_name, max_concurrency = 4):
+                raise IOError(f"Could not upload {dataset} rows to {directory}/{blob_name}")
+
+    def flush(self, datasets = None):
+        datasets = [dataset for dataset in (datasets or list(self.buffers)) if dataset in self.buffers]
+        self.last_flush = time.monotonic()
+        if not datasets:
+            return
+        with ThreadPoolExecutor(max_workers = len(datasets)) as executor:
+            list(executor.map(self.upload_dataset, datasets))
+
+    def close(self):
+        self.flush()
+
+
+class AsyncAzureUtils:
+    """asyncio variant of AzureUtils, lets one worker run many blob and queue operations concurrently.
+
+    aio clients are bound to the running event loop, so they are created per instance and closed with close()
+    (or by using the instance as an async context manager).
+    """
+    def __init__(self, max_concurrency = None):
+        self.blob_service_client = None
+        self.queue_client = None
+        self.max_concurrency = max_concurrency or int(os.getenv("BLOB_DOWNLOAD_WORKERS", 16))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.blob_service_client is not None:
+            await self.blob_service_client.close()
+        if self.queue_client is not None:
+            await self.queue_client.close()
+
+    def initialize_storage_account_ad(self, storage_account_secret, blob):
+        from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+        
+        try:
+            self.blob_service_client = AsyncBlobServiceClient(
+                account_url = "{}://{}.blob.core.windows.net".format("https", blob),
+                credential = storage_account_secret
+                )
+        except Exception as e:
+            logging.error(f"Could not create async blob service client: {e}")
+
+    def initialize_queue_client(self, accountUrl, queueName):
+        from azure.storage.queue import BinaryBase64EncodePolicy, BinaryBase64DecodePolicy
+        from azure.storage.queue.aio import QueueClient as AsyncQueueClient
+        
+        try:
+            self.queue_client = AsyncQueueClient.from_connection_string(
+                conn_str = accountUrl,
+                queue_name = queueName,
+                message_encode_policy = BinaryBase64EncodePolicy(),
+                message_decode_policy = BinaryBase64DecodePolicy()
+                )
+            logging.info(f"Connected to queue {queueName} successfully")
+        except Exception as e:
+            logging.error(f"Error connecting to queue {queueName}: {e}")
+
+    async def send_queue_message(self, message):
+        async with self.semaphore:
+            try:
+                await self.queue_client.send_message(message.encode("utf-8"))
+                logging.info(f"Queued message {message} successfully")
+            except Exception as e:
+                logging.error(f"Error queueing message {message}: {e}")
+
+    async def upload_blob(self, data, container, blob_name):
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        async with self.semaphore:
+            try:
+                await blob_client_instance.upload_blob(data, overwrite = True, length = len(data))
+                logging.info(f"Created blob {blob_name} successfully")
+                return True
+            except Exception as e:
+                logging.error(f"Error creating blob {blob_name}: {e}")
+                return False
+
+    async def list_blobs(self, container, blob_name_starts_with):
+        container_client_instance = self.blob_service_client.get_container_client(container)
+        return [blob async for blob in container_client_instance.list_blobs(blob_name_starts_with)]
+
+    async def download_parquet_table(self, container, blob_name, columns = None, filters = None):
+        blob_client_instance = self.blob_service_client.get_blob_client(container, blob_name, snapshot = None)
+        async with self.semaphore:
+            downloader = await blob_client_instance.download_blob(max_concurrency = 4)
+            data = await downloader.readall()
+        # Decode off the event loop so other downloads keep running
+        source = pa.BufferReader(pa.py_buffer(data))
+        return await asyncio.to_thread(pq.read_table, source, columns = get_existing_columns(source, columns), filters = filters)
+
+    async def download_parquet_blob(self, container, blob_name, columns = None, filters = None):
+        table = await self.download_parquet_table(container, blob_name, columns, filters)
+        return table.to_pandas()
+
+    async def ingest_table(self, container, directory, columns = None, keys = None, filters = None):
+        """Async counterpart of AzureUtils.ingest_table, newest blobs win when keys are given.
+
+        At most max_concurrency downloads run ahead of the blob being deduplicated, so only that many decoded
+        tables are held at once instead of the whole directory.
+        """
+        blob_list = sorted(prefer_compacted(await self.list_blobs(container, directory)), key = lambda blob: blob.name, reverse = True)
+        deduplicator = KeyDeduplicator(keys)
+        sink = DataFrameSink()
+        pending = deque()
+
+        def write_table(table):
+            for batch in table.replace_schema_metadata(None).to_batches():
+                batch = deduplicator.filter(batch)
+                if batch.num_rows > 0:
+                    sink.write_batch(batch)
+
+        try:
+            for blob in blob_list:
+                pending.append(asyncio.create_task(self.download_parquet_table(container, blob.name, columns, filters)))
+                if len(pending) >= self.max_concurrency:
+                    write_table(await pending.popleft())
+            while pending:
+                write_table(await pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+        return sink.to_pandas()
+
+    async def ingest_bronze_data(self, directory, columns = None, keys = None, filters = None):
+        return await self.ingest_table("bronze", directory, columns, keys, filters)